@@ -0,0 +1,74 @@
+import argparse
+from app.services.aggregate_service import rebuild_aggregates
+from app.services.sketch_service import rebuild_amount_sketches
+from app.services.transaction_service import remove_duplicate_transactions
+from app.database.indexes import ensure_indexes, print_explain_plans
+
+
+def rebuild_aggregates_command(args):
+    weeks = rebuild_aggregates()
+    print(f"Rebuilt aggregates for {weeks} weeks.")
+
+
+def rebuild_sketches_command(args):
+    transactions = rebuild_amount_sketches()
+    print(f"Rebuilt amount sketches from {transactions} transactions.")
+
+
+def dedupe_transactions_command(args):
+    removed = remove_duplicate_transactions()
+    print(f"Removed {removed} duplicate transactions.")
+    if removed:
+        weeks = rebuild_aggregates()
+        transactions = rebuild_amount_sketches()
+        print(f"Rebuilt aggregates for {weeks} weeks and amount sketches from {transactions} transactions.")
+    for index in ensure_indexes():
+        print(f"Ensured index {index}")
+
+
+def create_indexes_command(args):
+    for index in ensure_indexes():
+        print(f"Ensured index {index}")
+
+
+def explain_command(args):
+    print_explain_plans(verbose=args.verbose)
+
+
+def export_snapshot_command(args):
+    from app.services.snapshot_service import export_transactions_snapshot
+    exported = export_transactions_snapshot(directory=args.directory, full=args.full)
+    print(f"Exported {exported} transactions.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Financial analyzer maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_parser = subparsers.add_parser("rebuild-aggregates", help="Recompute the spend/earn aggregates from raw transactions")
+    rebuild_parser.set_defaults(func=rebuild_aggregates_command)
+
+    sketches_parser = subparsers.add_parser("rebuild-sketches", help="Recompute the amount quantile sketches from raw transactions")
+    sketches_parser.set_defaults(func=rebuild_sketches_command)
+
+    dedupe_parser = subparsers.add_parser("dedupe-transactions", help="Remove repeated transaction_ids, rebuild derived data and create the unique index")
+    dedupe_parser.set_defaults(func=dedupe_transactions_command)
+
+    indexes_parser = subparsers.add_parser("create-indexes", help="Create the indexes the service queries rely on")
+    indexes_parser.set_defaults(func=create_indexes_command)
+
+    explain_parser = subparsers.add_parser("explain", help="Print the query plan of every query the service issues")
+    explain_parser.add_argument("--verbose", action="store_true", help="Also print the full explain() output")
+    explain_parser.set_defaults(func=explain_command)
+
+    snapshot_parser = subparsers.add_parser("export-snapshot", help="Write new transactions to the partitioned Parquet snapshot")
+    snapshot_parser.add_argument("--directory", default=None, help="Snapshot directory (defaults to SNAPSHOT_DIR)")
+    snapshot_parser.add_argument("--full", action="store_true", help="Discard the existing snapshot and export everything")
+    snapshot_parser.set_defaults(func=export_snapshot_command)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
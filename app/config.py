@@ -21,6 +21,56 @@ class Config:
     # OpenAI API Key
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     OPEN_AI_MODEL = os.getenv('OPEN_AI_MODEL')
+    OPENAI_API_BASE = os.getenv('OPENAI_API_BASE')
+    
+    # Seconds each narrative version may take before it is abandoned
+    NARRATIVE_TIMEOUT = float(os.getenv('NARRATIVE_TIMEOUT', '60'))
+    
+    # Compact tabular prompt encoding and an optional token budget for the prompt data
+    PROMPT_COMPACT = os.getenv('PROMPT_COMPACT', 'false').lower() == 'true'
+    PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET')) if os.getenv('PROMPT_TOKEN_BUDGET') else None
+    
+    # In-process narrative cache limits (entries, seconds)
+    NARRATIVE_CACHE_SIZE = int(os.getenv('NARRATIVE_CACHE_SIZE', '1024'))
+    NARRATIVE_CACHE_TTL = float(os.getenv('NARRATIVE_CACHE_TTL', '3600'))
+    
+    # Connection pool size for pymongo and worker threads for offloaded database calls
+    MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
+    DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '16'))
+    
+    # Directory holding the partitioned Parquet snapshot of the transactions collection
+    SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'data/snapshots/transactions')
+    
+    # Background upload jobs: worker processes, jobs run at once per replica, queued jobs
+    # accepted across all replicas, seconds a claimed job stays owned without a heartbeat,
+    # and seconds between checks for claimable jobs
+    JOB_PROCESS_WORKERS = int(os.getenv('JOB_PROCESS_WORKERS', '2'))
+    JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', '2'))
+    JOB_QUEUE_LIMIT = int(os.getenv('JOB_QUEUE_LIMIT', '20'))
+    JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '600'))
+    JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '5'))
+    
+    # Number of analysis documents written per insert_many round trip
+    ANALYSIS_BATCH_SIZE = int(os.getenv('ANALYSIS_BATCH_SIZE', '1000'))
+    
+    # Rows read per chunk by the streaming CSV upload
+    CSV_CHUNK_SIZE = int(os.getenv('CSV_CHUNK_SIZE', '50000'))
+    
+    # Trend responses kept in memory, and the most analyses one trend request may cover
+    TREND_CACHE_SIZE = int(os.getenv('TREND_CACHE_SIZE', '128'))
+    TREND_MAX_ANALYSES = int(os.getenv('TREND_MAX_ANALYSES', '10000'))
+    
+    # Relative error of the amount quantile sketches (rebuild them after changing it), and the
+    # transactions a category needs before its own thresholds replace the overall ones
+    SKETCH_RELATIVE_ACCURACY = float(os.getenv('SKETCH_RELATIVE_ACCURACY', '0.01'))
+    SKETCH_MIN_COUNT = int(os.getenv('SKETCH_MIN_COUNT', '30'))
+    
+    # Merchant categorization: local gensim KeyedVectors file (unset disables it), on-disk and
+    # in-memory merchant vector caches, and the cosine similarity a category match needs
+    CATEGORY_MODEL_PATH = os.getenv('CATEGORY_MODEL_PATH')
+    MERCHANT_VECTOR_CACHE_PATH = os.getenv('MERCHANT_VECTOR_CACHE_PATH', 'data/merchant_vectors.sqlite')
+    MERCHANT_VECTOR_CACHE_SIZE = int(os.getenv('MERCHANT_VECTOR_CACHE_SIZE', '50000'))
+    CATEGORY_MIN_SIMILARITY = float(os.getenv('CATEGORY_MIN_SIMILARITY', '0.35'))
     
     # Choose the database name based on whether testing is enabled
     @staticmethod
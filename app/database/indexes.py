@@ -0,0 +1,154 @@
+import json
+import logging
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from app.database.mongo import db
+from app.services.query_service import spending_by_category_pipeline, earnings_by_region_pipeline, top_merchants_pipeline
+
+logger = logging.getLogger(__name__)
+
+NARRATIVE_VERSIONS = ['zero_shot', 'few_shot', 'cot']
+
+INDEXES = {
+    'transactions': [
+        ([('uuid', ASCENDING)], {}),
+        ([('year', ASCENDING), ('month', ASCENDING), ('week_of_month', ASCENDING)], {}),
+        ([('transaction_id', ASCENDING)], {'unique': True}),
+        ([('date', ASCENDING)], {}),
+    ],
+    'weekly_aggregates': [
+        ([('year', ASCENDING), ('month', ASCENDING), ('week_of_month', ASCENDING)], {'unique': True}),
+    ],
+    'monthly_aggregates': [
+        ([('year', ASCENDING), ('month', ASCENDING)], {'unique': True}),
+    ],
+    'analysis': [
+        ([('uuid', ASCENDING), ('_id', ASCENDING)], {}),
+    ],
+    'upload_fingerprints': [
+        ([('uuid', ASCENDING)], {}),
+    ],
+    'jobs': [
+        ([('status', ASCENDING), ('created_at', ASCENDING)], {}),
+        ([('status', ASCENDING), ('lease_expires_at', ASCENDING)], {}),
+    ],
+    'analysis_interpretations_collection': [
+        ([(f'cache_keys.{version}', ASCENDING), ('_id', DESCENDING)], {})
+        for version in NARRATIVE_VERSIONS
+    ],
+}
+
+
+def ensure_indexes():
+    # Idempotent: create_index is a no-op when an identical index already exists
+    created = []
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                created.append(f"{collection}.{_create_index(db[collection], keys, options)}")
+            except DuplicateKeyError:
+                # Rows stored before transaction_id was unique; the service keeps working without the index
+                logger.warning(
+                    "Cannot create unique index on %s %s: duplicates exist. Run `python -m app.cli dedupe-transactions`.",
+                    collection, keys
+                )
+    return created
+
+
+def _create_index(collection, keys, options):
+    try:
+        return collection.create_index(keys, **options)
+    except OperationFailure as e:
+        # 85/86: an index on the same keys exists with other options, e.g. the old non-unique one
+        if e.code not in (85, 86):
+            raise
+        name = '_'.join(f'{field}_{direction}' for field, direction in keys)
+        collection.drop_index(name)
+        try:
+            return collection.create_index(keys, **options)
+        except DuplicateKeyError:
+            # Put the plain index back so lookups stay indexed until the duplicates are removed
+            collection.create_index(keys)
+            raise
+
+
+class _Aggregation:
+    # Stands in for a cursor so aggregation pipelines are explained alongside the finds
+    def __init__(self, collection, pipeline):
+        self.collection = collection
+        self.pipeline = pipeline
+
+    def explain(self):
+        return self.collection.database.command('aggregate', self.collection.name, pipeline=self.pipeline, explain=True)
+
+
+def service_queries():
+    # Every read the service issues, in the shape it issues them
+    return [
+        ('get_transactions', db.transactions.find({'uuid': 'example-uuid'})),
+        ('find_known_transaction_ids', db.transactions.find(
+            {'transaction_id': {'$in': ['example-id']}, 'uuid': {'$ne': 'example-uuid'}},
+            {'_id': 0, 'transaction_id': 1}
+        )),
+        ('get_all_transactions', db.transactions.find()),
+        ('get_last_n_analyses', db.analysis.find().sort('_id', -1).limit(3)),
+        ('get_latest_analysis_id', db.analysis.find({}, {'_id': 1}).sort('_id', -1).limit(1)),
+        ('get_analysis_series', db.analysis.find({}, {'current_week_spending': 1}).sort('_id', -1).limit(1000)),
+        ('get_weekly_aggregates', db.weekly_aggregates.find({}, {'_id': 0})),
+        ('get_monthly_aggregates', db.monthly_aggregates.find({}, {'_id': 0})),
+        ('get_amount_thresholds', db.amount_sketches.find({})),
+        ('get_overall_aggregate', db.overall_aggregates.find({'_id': 'overall'}, {'_id': 0}).limit(1)),
+        ('update_aggregates (weekly upsert)', db.weekly_aggregates.find({'year': 2024, 'month': 1, 'week_of_month': 1}).limit(1)),
+        ('update_aggregates (monthly upsert)', db.monthly_aggregates.find({'year': 2024, 'month': 1}).limit(1)),
+        ('find_cached_narrative', db.analysis_interpretations_collection.find(
+            {'cache_keys.zero_shot': 'example-key', 'narratives.zero_shot': {'$ne': ''}},
+            {'narratives.zero_shot': 1}
+        ).sort('_id', -1).limit(1)),
+        ('claim_next_job', db.jobs.find({'$or': [
+            {'status': 'pending'},
+            {'status': 'running', 'lease_expires_at': {'$lt': datetime.utcnow()}}
+        ]}).sort('created_at', 1).limit(1)),
+        ('get_job_results', db.analysis.find({'uuid': 'example-uuid'}).sort('_id', 1).limit(100)),
+        ('get_upload_analyses', db.analysis.find({'uuid': 'example-uuid'}).sort('_id', 1)),
+        ('find_upload', db.upload_fingerprints.find({'_id': 'example-fingerprint'}).limit(1)),
+        ('find_upload_by_uuid', db.upload_fingerprints.find({'uuid': 'example-uuid'}).limit(1)),
+        ('get_spending_by_category', _Aggregation(db.transactions, spending_by_category_pipeline('2024-01-01', '2024-12-31'))),
+        ('get_earnings_by_region', _Aggregation(db.transactions, earnings_by_region_pipeline('2024-01-01', '2024-12-31'))),
+        ('get_top_merchants', _Aggregation(db.transactions, top_merchants_pipeline())),
+    ]
+
+
+def _plan_stages(plan):
+    stages = []
+    while plan:
+        stage = plan.get('stage', '?')
+        if plan.get('indexName'):
+            stage = f"{stage}({plan['indexName']})"
+        stages.append(stage)
+        plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+    return ' <- '.join(stages)
+
+
+def explain_service_queries(verbose=False):
+    results = []
+    for name, cursor in service_queries():
+        explanation = cursor.explain()
+        # Pipelines whose $match is pushed down report the find plan under their first stage
+        planner = explanation.get('queryPlanner') or explanation.get('stages', [{}])[0].get('$cursor', {}).get('queryPlanner', {})
+        winning_plan = planner.get('winningPlan', {})
+        # Newer servers wrap the classic plan in queryPlan
+        winning_plan = winning_plan.get('queryPlan', winning_plan)
+        results.append({
+            'query': name,
+            'plan': _plan_stages(winning_plan),
+            'explain': explanation if verbose else None
+        })
+    return results
+
+
+def print_explain_plans(verbose=False):
+    for result in explain_service_queries(verbose):
+        print(f"{result['query']}: {result['plan']}")
+        if verbose:
+            print(json.dumps(result['explain'], indent=2, default=str))
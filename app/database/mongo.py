@@ -1,5 +1,18 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pymongo import MongoClient
 from app.config import Config
 
-client = MongoClient(Config.MONGO_URI)
+client = MongoClient(Config.MONGO_URI, maxPoolSize=Config.MONGO_MAX_POOL_SIZE)
 db = client[Config.get_database_name()]
+
+# Bounded pool that blocking pymongo calls are offloaded to from async endpoints
+db_executor = ThreadPoolExecutor(max_workers=Config.DB_EXECUTOR_WORKERS, thread_name_prefix="mongo")
+
+async def run_db(function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context into the worker thread so per-request stage traces see the call
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(db_executor, partial(context.run, function, *args, **kwargs))
@@ -1,18 +1,34 @@
+import asyncio
 import pandas as pd
 import uuid
 import json
 import openai
 import logging
+import time
+from typing import List, Optional
 from app.config import Config
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse, Response
 from pydantic import BaseModel
-from app.utils.data_processing import preprocess_data, preprocess_single_transaction
+from app.utils.data_processing import preprocess_data, preprocess_transaction_record, collect_statistics, upload_statistics, STATISTICS_COLUMNS
+from app.utils.serialization import dumps, dumps_line
+from app.utils.metrics import registry, timed, record_stage, start_trace, finish_trace, format_trace, REQUEST_SECONDS, REQUESTS_TOTAL, LLM_FIRST_TOKEN_SECONDS
 from app.utils.prompts import generate_financial_analysis_prompt_zero_shot, generate_financial_analysis_prompt_few_shot, generate_financial_analysis_prompt_cot
-from app.services.financial_analyzer import compare_last_three_analyses, get_historical_average_spending, get_current_week_spending, get_historical_average_earnings, get_current_week_earnings, get_monthly_totals, get_overall_totals, get_historical_monthly_totals
-from app.services.transaction_service import save_transaction,  get_total_transaction_count, get_all_transactions, save_analysis, get_last_n_analyses
+from app.services.financial_analyzer import compare_last_three_analyses, get_historical_average_spending, get_current_week_spending, get_historical_average_earnings, get_current_week_earnings, get_monthly_totals, get_overall_totals, get_historical_monthly_totals, analyze_transactions_batch
+from app.services.transaction_service import save_transaction, save_transaction_record, get_total_transaction_count, save_analyses, get_last_n_analyses, find_known_transaction_ids, filter_new_transactions, get_upload_analyses
+from app.services.upload_service import fingerprint_file, find_upload, find_upload_by_uuid, record_upload, upload_counts
+from app.services.aggregate_service import get_weekly_aggregates, get_monthly_aggregates, get_overall_aggregate
 from app.schemas.models import Transaction, TransactionsAnalysisPayload
-from app.services.interpretation import save_interpretation
+from app.services.interpretation import save_interpretation, find_cached_narrative
+from app.services.query_service import get_spending_by_category, get_earnings_by_region, get_top_merchants
+from app.services.job_service import create_job, count_queued_jobs, get_job, get_job_results
+from app.services.job_runner import job_runner
+from app.services.narrative_cache import narrative_cache, narrative_cache_key
+from app.services.trend_service import get_analysis_trends
+from app.services.sketch_service import get_amount_thresholds
+from app.utils.quantile_sketch import flag_amount
+from app.database.mongo import db_executor, run_db
+from app.database.indexes import ensure_indexes
 
 app = FastAPI()
 
@@ -20,6 +36,49 @@ app = FastAPI()
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+TRACE_HEADER = "X-Stage-Trace"
+
+async def log_streamed_stages(body, trace, method, path):
+    # The header is sent before a streamed body runs, so stages that finish afterwards are logged
+    sent = len(trace)
+    async for chunk in body:
+        yield chunk
+    if len(trace) > sent:
+        logger.info("Stage breakdown %s %s: %s", method, path, format_trace(trace))
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    # Opt-in per-request stage breakdown, returned as a response header
+    token = start_trace() if request.headers.get(TRACE_HEADER) else None
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        trace = finish_trace(token) if token is not None else None
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, path=path)
+    REQUESTS_TOTAL.inc(method=request.method, path=path, status=response.status_code)
+    if trace is not None:
+        response.headers["X-Stage-Breakdown"] = format_trace(trace)
+        response.body_iterator = log_streamed_stages(response.body_iterator, trace, request.method, path)
+    return response
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.on_event("startup")
+async def startup():
+    await run_db(ensure_indexes)
+    # Resumes pending jobs and jobs whose previous owner died
+    job_runner.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await job_runner.stop()
+    db_executor.shutdown(wait=True)
+
 @app.get("/")
 async def health_check():
     return {"status": "All good!"}
@@ -27,12 +86,17 @@ async def health_check():
 @app.post("/upload_single_transaction/", response_model=dict)
 async def upload_single_transaction(transaction: Transaction):
     try:
-        df = preprocess_single_transaction(pd.DataFrame([transaction.dict()]))
+        if await run_db(find_known_transaction_ids, [transaction.transaction_id]):
+            return {"status": "success", "message": "Transaction already saved.", "transaction_id": transaction.transaction_id}
+        record = preprocess_transaction_record(transaction.dict())
+        if record is None:
+            raise ValueError("Transaction has an invalid date or a city/region pair that is not recognised.")
         unique_id = transaction.uuid or str(uuid.uuid4())
-        save_transaction(df, unique_id)
+        if not await run_db(save_transaction_record, record, unique_id):
+            return {"status": "success", "message": "Transaction already saved.", "transaction_id": transaction.transaction_id}
         
         # Check if there are at least 30 transactions in the database
-        total_transaction_count = get_total_transaction_count()
+        total_transaction_count = await run_db(get_total_transaction_count)
         if total_transaction_count < 30:
             return {
                 "status": "success",
@@ -40,28 +104,33 @@ async def upload_single_transaction(transaction: Transaction):
                 "uuid": unique_id
             }
 
-        # Retrieve all transactions to calculate statistics
-        all_transactions = get_all_transactions()
+        # Retrieve the maintained aggregates to calculate statistics
+        weekly, monthly, overall, thresholds = await asyncio.gather(
+            run_db(get_weekly_aggregates),
+            run_db(get_monthly_aggregates),
+            run_db(get_overall_aggregate),
+            run_db(get_amount_thresholds)
+        )
         
         # Get the current transaction's year, month, and week
-        year = df.iloc[0]['year']
-        month = df.iloc[0]['month']
-        week_of_month = df.iloc[0]['week_of_month']
+        year = record['year']
+        month = record['month']
+        week_of_month = record['week_of_month']
         
         # Calculate historical average spending and earnings for the same week
-        historical_avg_spending = get_historical_average_spending(all_transactions, year, month, week_of_month)
-        historical_avg_earnings = get_historical_average_earnings(all_transactions, year, month, week_of_month)
+        historical_avg_spending = get_historical_average_spending(weekly, year, month, week_of_month)
+        historical_avg_earnings = get_historical_average_earnings(weekly, year, month, week_of_month)
         
         # Calculate current week's total spending and earnings
-        current_week_spending = get_current_week_spending(all_transactions, year, month, week_of_month)
-        current_week_earnings = get_current_week_earnings(all_transactions, year, month, week_of_month)
+        current_week_spending = get_current_week_spending(weekly, year, month, week_of_month)
+        current_week_earnings = get_current_week_earnings(weekly, year, month, week_of_month)
 
         # Calculate monthly totals
-        current_month_spending, current_month_earnings = get_monthly_totals(all_transactions, year, month)
-        historical_month_spending, historical_month_earnings = get_historical_monthly_totals(all_transactions, year, month)
+        current_month_spending, current_month_earnings = get_monthly_totals(monthly, year, month)
+        historical_month_spending, historical_month_earnings = get_historical_monthly_totals(monthly, year, month)
         
         # Calculate overall totals
-        overall_spending, overall_earnings = get_overall_totals(all_transactions)
+        overall_spending, overall_earnings = get_overall_totals(overall)
         
         return {
             "status": "success",
@@ -77,81 +146,233 @@ async def upload_single_transaction(transaction: Transaction):
             "historical_month_spending": historical_month_spending,
             "historical_month_earnings": historical_month_earnings,
             "overall_spending": overall_spending,
-            "overall_earnings": overall_earnings
+            "overall_earnings": overall_earnings,
+            **flag_amount(record['amount'], record['category'], thresholds)
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+NOT_ENOUGH_DATA_MESSAGE = "Not enough data to give analysis, but the data is saved to the database."
+NO_NEW_TRANSACTIONS_MESSAGE = "No new transactions, every row with a transaction_id is already saved."
+
+def analyze_uploaded_transactions(df, unique_id):
+    # Retrieve the maintained aggregates to calculate statistics
+    weekly = get_weekly_aggregates()
+    monthly = get_monthly_aggregates()
+    overall = get_overall_aggregate()
+    thresholds = get_amount_thresholds()
+    
+    # Analyze every uploaded transaction in one vectorized pass
+    comparisons = analyze_transactions_batch(df, weekly, monthly, overall, thresholds)
+    for comparison in comparisons:
+        comparison['uuid'] = unique_id
+    failed_analyses = save_analyses(comparisons)
+    return comparisons, failed_analyses
+
+def stream_comparisons(df, unique_id, counts, fingerprint):
+    # NDJSON: one line per comparison as each batch is analyzed and saved, then a summary line
+    weekly = get_weekly_aggregates()
+    monthly = get_monthly_aggregates()
+    overall = get_overall_aggregate()
+    thresholds = get_amount_thresholds()
+    yield dumps_line({"status": "success", "uuid": unique_id, "rows": len(df), **counts})
+
+    failed_analyses = []
+    try:
+        for start in range(0, len(df), Config.ANALYSIS_BATCH_SIZE):
+            comparisons = analyze_transactions_batch(df.iloc[start:start + Config.ANALYSIS_BATCH_SIZE], weekly, monthly, overall, thresholds)
+            for comparison in comparisons:
+                comparison['uuid'] = unique_id
+            failed_analyses.extend(save_analyses(comparisons))
+            for comparison in comparisons:
+                yield dumps_line(comparison)
+    except Exception as e:
+        yield dumps_line({"status": "error", "uuid": unique_id, "detail": str(e)})
+        return
+    record_upload(fingerprint, unique_id, analyzed=True)
+    yield dumps_line({"status": "complete", "uuid": unique_id, "failed_analyses": failed_analyses})
+
+def stream_stored_comparisons(unique_id, comparisons):
+    yield dumps_line({"status": "success", "uuid": unique_id, "rows": len(comparisons), "duplicate_upload": True})
+    for comparison in comparisons:
+        yield dumps_line(comparison)
+    yield dumps_line({"status": "complete", "uuid": unique_id, "failed_analyses": []})
+
+@timed("csv.parse")
+def read_upload(fileobj):
+    return pd.read_csv(fileobj)
+
+async def stored_upload_response(upload, stream):
+    # A byte-identical file was processed before: replay its results without parsing it again
+    unique_id = upload['uuid']
+    if not upload['analyzed']:
+        return {"status": "success", "message": upload.get('message'), "uuid": unique_id, "duplicate_upload": True}
+    comparisons = await run_db(get_upload_analyses, unique_id)
+    if stream:
+        return StreamingResponse(stream_stored_comparisons(unique_id, comparisons), media_type="application/x-ndjson")
+    return {"status": "success", "uuid": unique_id, "duplicate_upload": True, "comparisons": comparisons}
+
 @app.post("/upload_transactions/")
-async def upload_transactions(file: UploadFile = File(...)):
+async def upload_transactions(file: UploadFile = File(...), stream: bool = False):
     try:
-        df = pd.read_csv(file.file)
-        df = preprocess_data(df)
+        fingerprint = await run_db(fingerprint_file, file.file)
+        upload = await run_db(find_upload, fingerprint)
+        if upload is not None:
+            return await stored_upload_response(upload, stream)
+
+        # Parsing and preprocessing are CPU-bound, so they run off the event loop like the Mongo calls
+        df = await run_db(read_upload, file.file)
+        uploaded_rows = len(df)
+        statistics = await run_db(upload_statistics, df)
+        df, rejected_rows = await run_db(filter_new_transactions, df)
+        counts = upload_counts(uploaded_rows - rejected_rows - len(df), rejected_rows)
         unique_id = str(uuid.uuid4())  # Generate a UUID
-        save_transaction(df, unique_id)
+        if df.empty:
+            await run_db(record_upload, fingerprint, unique_id, analyzed=False, message=NO_NEW_TRANSACTIONS_MESSAGE)
+            return {"status": "success", "message": NO_NEW_TRANSACTIONS_MESSAGE, "uuid": unique_id, **counts}
+
+        # Only transactions new to the database are preprocessed, saved and analyzed, but they are
+        # imputed with the statistics of the whole file
+        df = await run_db(preprocess_data, df, statistics)
+        df = await run_db(save_transaction, df, unique_id)
         
         # Check if there are at least 30 transactions in the database
-        total_transaction_count = get_total_transaction_count()
+        total_transaction_count = await run_db(get_total_transaction_count)
         if total_transaction_count < 30:
+            await run_db(record_upload, fingerprint, unique_id, analyzed=False, message=NOT_ENOUGH_DATA_MESSAGE)
             return {
                 "status": "success",
-                "message": "Not enough data to give analysis, but the data is saved to the database.",
-                "uuid": unique_id
+                "message": NOT_ENOUGH_DATA_MESSAGE,
+                "uuid": unique_id,
+                **counts
             }
         
-        # Retrieve all transactions to calculate statistics
-        all_transactions = get_all_transactions()
+        if stream:
+            return StreamingResponse(stream_comparisons(df, unique_id, counts, fingerprint), media_type="application/x-ndjson")
         
-        # Process each transaction separately
-        comparisons = []
-        for _, row in df.iterrows():
-            year = row['year']
-            month = row['month']
-            week_of_month = row['week_of_month']
-            
-            # Calculate historical average spending and earnings for the same week
-            historical_avg_spending = get_historical_average_spending(all_transactions, year, month, week_of_month)
-            historical_avg_earnings = get_historical_average_earnings(all_transactions, year, month, week_of_month)
-            
-            # Calculate current week's total spending and earnings
-            current_week_spending = get_current_week_spending(all_transactions, year, month, week_of_month)
-            current_week_earnings = get_current_week_earnings(all_transactions, year, month, week_of_month)
-
-            # Calculate monthly totals
-            current_month_spending, current_month_earnings = get_monthly_totals(all_transactions, year, month)
-            historical_month_spending, historical_month_earnings = get_historical_monthly_totals(all_transactions, year, month)
-            
-            # Calculate overall totals
-            overall_spending, overall_earnings = get_overall_totals(all_transactions)
-            
-            # Build the comparison object
-            comparison = {
-                "transaction_id": row['transaction_id'],
-                "historical_average_spending": historical_avg_spending,
-                "current_week_spending": current_week_spending,
-                "spending_comparison": current_week_spending - historical_avg_spending,
-                "historical_average_earnings": historical_avg_earnings,
-                "current_week_earnings": current_week_earnings,
-                "earnings_comparison": current_week_earnings - historical_avg_earnings,
-                "current_month_spending": current_month_spending,
-                "current_month_earnings": current_month_earnings,
-                "historical_month_spending": historical_month_spending,
-                "historical_month_earnings": historical_month_earnings,
-                "overall_spending": overall_spending,
-                "overall_earnings": overall_earnings
-            }
-            save_analysis(comparison)
-            # Append comparison object to list
-            comparisons.append(comparison)
+        comparisons, failed_analyses = await run_db(analyze_uploaded_transactions, df, unique_id)
+        await run_db(record_upload, fingerprint, unique_id, analyzed=True)
         
-        return {"status": "success", "uuid": unique_id, "comparisons": comparisons}
+        response = {"status": "success", "uuid": unique_id, **counts, "comparisons": comparisons}
+        if failed_analyses:
+            response["failed_analyses"] = failed_analyses
+        return response
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def read_upload_statistics(fileobj, chunk_size):
+    # First pass: whole-file imputation statistics from the columns that need them
+    statistics = collect_statistics(pd.read_csv(
+        fileobj,
+        chunksize=chunk_size,
+        usecols=lambda column: column.strip().lower() in STATISTICS_COLUMNS
+    ))
+    fileobj.seek(0)
+    return statistics
+
+@timed("csv.parse_chunk")
+def read_next_chunk(reader):
+    return next(reader, None)
+
+@timed("upload.process_chunk")
+def process_upload_chunk(chunk, index, unique_id, statistics):
+    try:
+        chunk_rows = len(chunk)
+        df, rejected_rows = filter_new_transactions(chunk)
+        counts = upload_counts(chunk_rows - rejected_rows - len(df), rejected_rows)
+        if not df.empty:
+            df = save_transaction(preprocess_data(df, statistics), unique_id)
+        result = {"status": "success", "uuid": unique_id, "chunk": index, "rows": len(df), **counts}
+        
+        # Check if there are at least 30 transactions in the database
+        if df.empty:
+            result["message"] = NO_NEW_TRANSACTIONS_MESSAGE
+        elif get_total_transaction_count() < 30:
+            result["message"] = NOT_ENOUGH_DATA_MESSAGE
+        else:
+            comparisons, failed_analyses = analyze_uploaded_transactions(df, unique_id)
+            result["comparisons"] = comparisons
+            if failed_analyses:
+                result["failed_analyses"] = failed_analyses
+    except Exception as e:
+        result = {"status": "error", "uuid": unique_id, "chunk": index, "detail": str(e)}
+    return result
+
+@app.post("/upload_transactions_chunked/")
+async def upload_transactions_chunked(file: UploadFile = File(...), chunk_size: int = Config.CSV_CHUNK_SIZE):
+    try:
+        # Parsing a multi-GB upload must not hold up the event loop
+        statistics = await run_db(read_upload_statistics, file.file, chunk_size)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    unique_id = str(uuid.uuid4())  # Generate a UUID
+
+    async def chunk_stream():
+        # Second pass: read, preprocess, save and analyze one bounded chunk at a time off the event loop
+        reader = pd.read_csv(file.file, chunksize=chunk_size)
+        index = 0
+        while True:
+            chunk = await run_db(read_next_chunk, reader)
+            if chunk is None:
+                break
+            yield dumps_line(await run_db(process_upload_chunk, chunk, index, unique_id, statistics))
+            index += 1
+
+    return StreamingResponse(chunk_stream(), media_type="application/x-ndjson")
+
+@app.post("/jobs/upload_transactions/", status_code=202)
+async def upload_transactions_job(file: UploadFile = File(...)):
+    try:
+        fingerprint = await run_db(fingerprint_file, file.file)
+        upload = await run_db(find_upload, fingerprint)
+        if upload is not None:
+            # Same bytes as an upload that already finished, whichever endpoint took it; nothing is queued
+            content = {"status": "duplicate", "uuid": upload['uuid'], "analyzed": upload['analyzed'], "duplicate_upload": True}
+            if upload.get('job_id'):
+                content["job_id"] = upload['job_id']
+            if upload['analyzed']:
+                content["results"] = f"/uploads/{upload['uuid']}/results"
+            else:
+                content["message"] = upload.get('message')
+            return JSONResponse(status_code=200, content=content)
+        if await run_db(count_queued_jobs) >= Config.JOB_QUEUE_LIMIT:
+            raise HTTPException(status_code=429, detail="Too many queued upload jobs, retry later.")
+        job = await run_db(create_job, file.file, file.filename, fingerprint)
+        job_runner.wake()
+        return {"status": "queued", "job_id": job['_id'], "uuid": job['uuid']}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    job = await run_db(get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_comparisons(job_id: str, skip: int = 0, limit: int = 100):
+    job = await run_db(get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    comparisons = await run_db(get_job_results, job['uuid'], skip, min(limit, 1000))
+    return {"status": job['status'], "job_id": job_id, "comparisons": comparisons}
+
+@app.get("/uploads/{unique_id}/results")
+async def get_upload_comparisons(unique_id: str, skip: int = 0, limit: int = 100):
+    upload = await run_db(find_upload_by_uuid, unique_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    comparisons = await run_db(get_job_results, unique_id, skip, min(limit, 1000))
+    return {"status": "success", "uuid": unique_id, "analyzed": upload['analyzed'], "message": upload.get('message'), "comparisons": comparisons}
+
 @app.get("/compare_last_three_analyses/")
 async def compare_last_three_analyses_endpoint():
     try:
-        past_analyses = get_last_n_analyses(3)
+        past_analyses = await run_db(get_last_n_analyses, 3)
         if len(past_analyses) < 3:
             raise HTTPException(status_code=404, detail="Not enough past analyses found for comparison")
         
@@ -160,61 +381,167 @@ async def compare_last_three_analyses_endpoint():
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/analysis_trends/")
+async def analysis_trends(n: int = 30, window: int = 3, metrics: Optional[List[str]] = Query(None)):
+    try:
+        trends = await run_db(get_analysis_trends, min(n, Config.TREND_MAX_ANALYSES), metrics, window)
+        return Response(dumps({"status": "success", **trends}), media_type="application/json")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/breakdowns/spending-by-category/")
+async def spending_by_category(start_date: Optional[str] = None, end_date: Optional[str] = None):
+    try:
+        breakdown = await run_db(get_spending_by_category, start_date, end_date)
+        return {"status": "success", "breakdown": breakdown}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/breakdowns/earnings-by-region/")
+async def earnings_by_region(start_date: Optional[str] = None, end_date: Optional[str] = None):
+    try:
+        breakdown = await run_db(get_earnings_by_region, start_date, end_date)
+        return {"status": "success", "breakdown": breakdown}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/breakdowns/top-merchants/")
+async def top_merchants(limit: int = 10, start_date: Optional[str] = None, end_date: Optional[str] = None):
+    try:
+        breakdown = await run_db(get_top_merchants, limit, start_date, end_date)
+        return {"status": "success", "breakdown": breakdown}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # OpenAI API key
 openai.api_key = Config.OPENAI_API_KEY
+if Config.OPENAI_API_BASE:
+    openai.api_base = Config.OPENAI_API_BASE
+
+PROMPT_BUILDERS = {
+    'zero_shot': generate_financial_analysis_prompt_zero_shot,
+    'few_shot': generate_financial_analysis_prompt_few_shot,
+    'cot': generate_financial_analysis_prompt_cot
+}
+
+async def cancel_on_disconnect(request, tasks):
+    # uvicorn drops writes to a closed connection instead of failing them, so the stream
+    # would otherwise keep running until every LLM call finishes
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+    for task in tasks:
+        task.cancel()
 
 @app.post("/generate-narrative/")
-async def generate_narrative(data: TransactionsAnalysisPayload):
+async def generate_narrative(data: TransactionsAnalysisPayload, request: Request):
     transactions = [transaction.dict() for transaction in data.transactions]
     analysis = data.analysis.dict()
     
     # OpenAI API key
     openai.api_key = Config.OPENAI_API_KEY
     model = Config.OPEN_AI_MODEL
-    versions = ['zero_shot', 'few_shot', 'cot']
+    versions = list(PROMPT_BUILDERS)
     narratives = {version: "" for version in versions}
+    payload = {"transactions": transactions, "analysis": analysis}
+    # Keyed on the rendered prompt, so the encoding, token budget and template all invalidate entries
+    prompts = {version: PROMPT_BUILDERS[version](payload, Config.PROMPT_COMPACT, Config.PROMPT_TOKEN_BUDGET) for version in versions}
+    cache_keys = {version: narrative_cache_key(model, version, prompts[version]) for version in versions}
+    generated = []
+
+    async def lookup_cached(version):
+        cache_key = cache_keys[version]
+        narrative = narrative_cache.get(cache_key)
+        if narrative is not None:
+            narrative_cache.record("memory_hits")
+            return narrative
+        narrative = await run_db(find_cached_narrative, version, cache_key)
+        if narrative is not None:
+            narrative_cache.record("store_hits")
+            narrative_cache.put(cache_key, narrative)
+            return narrative
+        narrative_cache.record("misses")
+        return None
+
+    async def stream_version(version, queue):
+        key_name = f"narrative_{version}"
+        narrative = ""
+
+        async def consume():
+            nonlocal narrative
+            start = time.perf_counter()
+            first_token = True
+            response = await openai.ChatCompletion.acreate(
+                model=model,
+                messages=[{"role": "user", "content": prompts[version]}],
+                temperature=0.1,
+                stream=True
+            )
+            async for event in response:
+                if 'content' in event['choices'][0]['delta']:
+                    if first_token:
+                        LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start, version=version)
+                        first_token = False
+                    response_message = event['choices'][0]['delta']['content']
+                    narrative += response_message
+                    json_data = json.dumps({key_name: response_message})
+                    await queue.put(f"event:narrative_{version}\ndata: {json_data}\n\n")
+            record_stage(f"llm.{version}", time.perf_counter() - start)
+
+        try:
+            cached = await lookup_cached(version)
+            if cached is not None:
+                # Replay the stored narrative over the same events without calling the LLM
+                narratives[version] = cached
+                await queue.put(f"event:narrative_{version}\ndata: {json.dumps({key_name: cached})}\n\n")
+                await queue.put(f"event:end_narrative_{version}\ndata: stream ended\n\n")
+                return
+
+            await asyncio.wait_for(consume(), timeout=Config.NARRATIVE_TIMEOUT)
+            # Save the complete narrative for this version; only non-empty ones are cached and persisted
+            narratives[version] = narrative
+            if narrative:
+                narrative_cache.put(cache_keys[version], narrative)
+                generated.append(version)
+            await queue.put(f"event:end_narrative_{version}\ndata: stream ended\n\n")
+        except asyncio.TimeoutError:
+            error_message = f"Version {version} timed out after {Config.NARRATIVE_TIMEOUT} seconds"
+            await queue.put(f"event:error\ndata: {json.dumps({'error': error_message})}\n\n")
+        except Exception as e:
+            error_message = f"An error occurred for version {version}: {str(e)}"
+            await queue.put(f"event:error\ndata: {json.dumps({'error': error_message})}\n\n")
+        finally:
+            await queue.put(None)
 
     async def response_stream():
         yield "event:start_narrative_stream\ndata: stream started\n\n"
 
-        for version in versions:
-            try:
-                if version == 'zero_shot':
-                    prompt = generate_financial_analysis_prompt_zero_shot({"transactions": transactions, "analysis": analysis})
-                elif version == 'few_shot':
-                    prompt = generate_financial_analysis_prompt_few_shot({"transactions": transactions, "analysis": analysis})
-                elif version == 'cot':
-                    prompt = generate_financial_analysis_prompt_cot({"transactions": transactions, "analysis": analysis})
-                
-                key_name = f"narrative_{version}"
-                response = openai.ChatCompletion.create(
-                    model=model,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.1,
-                    stream=True
-                )
-
-                narrative = ""
-                for event in response:
-                    if 'content' in event['choices'][0]['delta']:
-                        response_message = event['choices'][0]['delta']['content']
-                        narrative += response_message
-                        json_data = json.dumps({key_name: response_message})
-                        yield f"event:narrative_{version}\ndata: {json_data}\n\n"
-
-                # Save the complete narrative for this version
-                narratives[version] = narrative
-
-            except Exception as e:
-                error_message = f"An error occurred for version {version}: {str(e)}"
-                yield f"event:error\ndata: {json.dumps({'error': error_message})}\n\n"
-                continue  # Continue to next version
-
-            yield f"event:end_narrative_{version}\ndata: stream ended\n\n"
-
-        # Save all narratives to the database
-        save_interpretation(transactions[0]['transaction_id'], narratives)
+        # Run all versions concurrently and multiplex their events as they arrive
+        queue = asyncio.Queue()
+        tasks = [asyncio.create_task(stream_version(version, queue)) for version in versions]
+        watcher = asyncio.create_task(cancel_on_disconnect(request, tasks))
+        try:
+            finished = 0
+            while finished < len(tasks):
+                message = await queue.get()
+                if message is None:
+                    finished += 1
+                    continue
+                yield message
+        finally:
+            # Stops the LLM calls when the client disconnects mid-stream
+            watcher.cancel()
+            for task in tasks:
+                task.cancel()
+
+        # Save the narratives unless every version was replayed from the cache or came back empty
+        if generated:
+            stored_keys = {version: cache_key for version, cache_key in cache_keys.items() if narratives[version]}
+            await run_db(save_interpretation, transactions[0]['transaction_id'], narratives, stored_keys)
 
         yield "event:end_narrative_stream\ndata: stream ended\n\n"
 
     return StreamingResponse(response_stream(), media_type="text/event-stream")
+
+@app.get("/narrative-cache/stats/")
+async def narrative_cache_stats():
+    return {"status": "success", "narrative_cache": narrative_cache.snapshot()}
@@ -0,0 +1,44 @@
+import pandas as pd
+
+# Compact in-memory dtypes for transaction DataFrames loaded from MongoDB
+TRANSACTION_DTYPES = {
+    'date': 'datetime64[ms]',
+    'amount': 'float64',
+    'merchant': 'category',
+    'category': 'category',
+    'city': 'category',
+    'region': 'category',
+    'payment_method': 'category',
+    'day_of_week': 'int8',
+    'week_of_month': 'int8',
+    'month': 'int8',
+    'year': 'int16',
+    'uuid': 'category',
+}
+
+# transaction_id is unique per row, so it keeps the string dtype pandas loads it with
+TRANSACTION_FIELDS = ['transaction_id'] + list(TRANSACTION_DTYPES)
+
+
+def transaction_projection(columns=None, include_id=False):
+    projection = {field: 1 for field in (columns or TRANSACTION_FIELDS)}
+    if not include_id:
+        projection['_id'] = 0
+    return projection
+
+
+def apply_transaction_dtypes(df):
+    dtypes = {column: dtype for column, dtype in TRANSACTION_DTYPES.items() if column in df.columns}
+    for column in ('day_of_week', 'week_of_month', 'month', 'year'):
+        # Integer casts fail on missing values, keep those columns as floats instead
+        if column in dtypes and df[column].isnull().any():
+            dtypes[column] = 'float32'
+    return df.astype(dtypes)
+
+
+def empty_transactions_frame(columns=None, include_id=False):
+    columns = list(columns or TRANSACTION_FIELDS)
+    frame = pd.DataFrame({column: pd.Series(dtype=TRANSACTION_DTYPES.get(column, 'object')) for column in columns})
+    if include_id:
+        frame.insert(0, '_id', pd.Series(dtype='object'))
+    return frame
@@ -0,0 +1,160 @@
+from app.database.mongo import db
+from app.database.indexes import INDEXES
+import pandas as pd
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from app.utils.metrics import timed
+
+WEEK_KEYS = ['year', 'month', 'week_of_month']
+MONTH_KEYS = ['year', 'month']
+TOTAL_FIELDS = ['spent', 'earned', 'spend_count', 'earn_count', 'count']
+OVERALL_ID = 'overall'
+
+
+def aggregate_weekly(df, amount_column='amount'):
+    # Collapse raw transactions into one row per (year, month, week_of_month)
+    amounts = df[amount_column]
+    frame = df[WEEK_KEYS].copy()
+    frame['spent'] = amounts.where(amounts < 0, 0)
+    frame['earned'] = amounts.where(amounts > 0, 0)
+    frame['spend_count'] = (amounts < 0).astype(int)
+    frame['earn_count'] = (amounts > 0).astype(int)
+    frame['count'] = 1
+    return frame.groupby(WEEK_KEYS, as_index=False)[TOTAL_FIELDS].sum()
+
+
+def _to_native(record):
+    return {key: (float(value) if key in ('spent', 'earned') else int(value)) for key, value in record.items()}
+
+
+def _increment(keys, record):
+    return UpdateOne(
+        {key: record[key] for key in keys},
+        {'$inc': {field: record[field] for field in TOTAL_FIELDS}},
+        upsert=True
+    )
+
+
+def _bulk_increment(collection, operations):
+    try:
+        collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Two first-time upserts of the same key race on the unique index; the loser is safe to replay
+        errors = e.details.get('writeErrors', [])
+        if any(error.get('code') != 11000 for error in errors):
+            raise
+        collection.bulk_write([operations[error['index']] for error in errors], ordered=False)
+
+
+def _apply_increments(weekly_records):
+    monthly_records = {}
+    for record in weekly_records:
+        key = (record['year'], record['month'])
+        totals = monthly_records.setdefault(key, {'year': key[0], 'month': key[1], **{field: 0 for field in TOTAL_FIELDS}})
+        for field in TOTAL_FIELDS:
+            totals[field] += record[field]
+    overall = {field: sum(record[field] for record in weekly_records) for field in TOTAL_FIELDS}
+
+    _bulk_increment(db.weekly_aggregates, [_increment(WEEK_KEYS, record) for record in weekly_records])
+    _bulk_increment(db.monthly_aggregates, [_increment(MONTH_KEYS, record) for record in monthly_records.values()])
+    db.overall_aggregates.update_one({'_id': OVERALL_ID}, {'$inc': overall}, upsert=True)
+
+
+@timed("mongo.update_aggregates")
+def update_aggregates(transactions):
+    if transactions.empty:
+        return
+    weekly = aggregate_weekly(transactions)
+    _apply_increments([_to_native(record) for record in weekly.to_dict("records")])
+
+
+@timed("mongo.update_record_aggregates")
+def update_record_aggregates(record):
+    amount = record['amount']
+    _apply_increments([{
+        'year': int(record['year']),
+        'month': int(record['month']),
+        'week_of_month': int(record['week_of_month']),
+        'spent': float(amount) if amount < 0 else 0.0,
+        'earned': float(amount) if amount > 0 else 0.0,
+        'spend_count': int(amount < 0),
+        'earn_count': int(amount > 0),
+        'count': 1
+    }])
+
+
+def _load(collection, keys):
+    frame = pd.DataFrame(list(collection.find({}, {'_id': 0})))
+    if frame.empty:
+        return pd.DataFrame(columns=keys + TOTAL_FIELDS)
+    return frame[keys + TOTAL_FIELDS]
+
+
+@timed("mongo.get_weekly_aggregates")
+def get_weekly_aggregates():
+    return _load(db.weekly_aggregates, WEEK_KEYS)
+
+
+@timed("mongo.get_monthly_aggregates")
+def get_monthly_aggregates():
+    return _load(db.monthly_aggregates, MONTH_KEYS)
+
+
+@timed("mongo.get_overall_aggregate")
+def get_overall_aggregate():
+    overall = db.overall_aggregates.find_one({'_id': OVERALL_ID}, {'_id': 0}) or {}
+    return {field: overall.get(field, 0) for field in TOTAL_FIELDS}
+
+
+# Mongo orders null and NaN below every number and strings above them, so the bounds keep
+# anything that is not a real amount out of spend and earn, as the pandas comparisons do
+SPEND_CONDITION = {'$and': [{'$lt': ['$amount', 0]}, {'$gte': ['$amount', float('-inf')]}]}
+EARN_CONDITION = {'$and': [{'$gt': ['$amount', 0]}, {'$lte': ['$amount', float('inf')]}]}
+
+
+def _swap_in(name, documents):
+    # Readers keep seeing the old aggregates until the rename replaces the collection in one step
+    staging = db[f'{name}_rebuild']
+    staging.drop()
+    db.create_collection(staging.name)
+    for keys, options in INDEXES.get(name, []):
+        staging.create_index(keys, **options)
+    if documents:
+        staging.insert_many(documents)
+    staging.rename(name, dropTarget=True)
+
+
+@timed("mongo.rebuild_aggregates")
+def rebuild_aggregates():
+    # Recompute every aggregate from the raw transactions collection on the server
+    pipeline = [
+        {'$project': {'_id': 0, 'year': 1, 'month': 1, 'week_of_month': 1, 'amount': 1}},
+        {'$group': {
+            '_id': {'year': '$year', 'month': '$month', 'week_of_month': '$week_of_month'},
+            'spent': {'$sum': {'$cond': [SPEND_CONDITION, '$amount', 0]}},
+            'earned': {'$sum': {'$cond': [EARN_CONDITION, '$amount', 0]}},
+            'spend_count': {'$sum': {'$cond': [SPEND_CONDITION, 1, 0]}},
+            'earn_count': {'$sum': {'$cond': [EARN_CONDITION, 1, 0]}},
+            'count': {'$sum': 1}
+        }}
+    ]
+    weekly_records = []
+    for group in db.transactions.aggregate(pipeline, allowDiskUse=True):
+        record = dict(group.pop('_id'))
+        record.update(group)
+        weekly_records.append(_to_native(record))
+
+    if weekly_records:
+        weekly = pd.DataFrame(weekly_records)
+        monthly = weekly.groupby(MONTH_KEYS, as_index=False)[TOTAL_FIELDS].sum()
+        overall = {field: int(weekly[field].sum()) if field.endswith('count') else float(weekly[field].sum()) for field in TOTAL_FIELDS}
+        overall['_id'] = OVERALL_ID
+        monthly_records = [_to_native(record) for record in monthly.to_dict("records")]
+        overall_records = [overall]
+    else:
+        monthly_records = overall_records = []
+
+    _swap_in('weekly_aggregates', weekly_records)
+    _swap_in('monthly_aggregates', monthly_records)
+    _swap_in('overall_aggregates', overall_records)
+    return len(weekly_records)
@@ -0,0 +1,176 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing
+import numpy as np
+from app.config import Config
+from app.utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Words describing each spending category; a category's centroid is the mean of their unit vectors
+CATEGORY_SEEDS = {
+    'Groceries': ['grocery', 'groceries', 'supermarket', 'market', 'food', 'produce', 'bakery'],
+    'Dining': ['restaurant', 'cafe', 'coffee', 'diner', 'grill', 'pizza', 'bistro', 'kitchen'],
+    'Utilities': ['electric', 'electricity', 'water', 'gas', 'internet', 'utility', 'power', 'phone'],
+    'Shopping': ['store', 'shop', 'retail', 'mall', 'clothing', 'electronics', 'department', 'outlet'],
+    'Travel': ['airline', 'airlines', 'hotel', 'flight', 'travel', 'taxi', 'rail', 'fuel'],
+    'Entertainment': ['cinema', 'movie', 'theater', 'music', 'games', 'concert', 'streaming', 'tickets'],
+    'Health': ['pharmacy', 'clinic', 'hospital', 'doctor', 'dental', 'health', 'medical', 'fitness'],
+}
+
+STOPWORDS = {'the', 'and', 'of', 'a', 'an', 'in', 'on', 'at', 'for', 'to', 'co', 'inc', 'llc', 'ltd', 'corp', 'company'}
+
+
+def normalize_merchant(merchant):
+    # Same cleaning as the semantic relation notebook: lowercase, no digits or punctuation, no stopwords
+    text = re.sub(r'[^a-z\s]', ' ', str(merchant).lower())
+    return ' '.join(word for word in text.split() if word not in STOPWORDS)
+
+
+class MerchantCategorizer:
+    def __init__(self, model_path, cache_path, cache_size, min_similarity):
+        self.model_path = model_path
+        self.cache_path = cache_path
+        self.cache_size = cache_size
+        self.min_similarity = min_similarity
+        self._model = None
+        self._model_id = None
+        self._centroids = None
+        self._categories = None
+        self._failed = False
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def available(self):
+        return bool(self.model_path) and not self._failed
+
+    def _load(self):
+        # Lazy: the first upload with uncategorized rows pays for it, processes that never need it never do
+        with self._lock:
+            if self._model is not None or self._failed:
+                return self._model
+            try:
+                from gensim.models import KeyedVectors
+                model = KeyedVectors.load(self.model_path, mmap='r')
+            except Exception:
+                logger.exception("Could not load the merchant embedding model from %s; categories fall back to the mode", self.model_path)
+                self._failed = True
+                return None
+            stat = os.stat(self.model_path)
+            self._model_id = f"{os.path.basename(self.model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+            self._categories, centroids = [], []
+            for category, words in CATEGORY_SEEDS.items():
+                vectors = [model.vectors[model.key_to_index[word]] for word in words if word in model.key_to_index]
+                if vectors:
+                    self._categories.append(category)
+                    centroids.append(_unit(np.mean(_unit(np.asarray(vectors, dtype=np.float32)), axis=0)))
+            self._centroids = np.asarray(centroids, dtype=np.float32)
+            self._model = model
+            return model
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        connection = sqlite3.connect(self.cache_path, timeout=30)
+        connection.execute('CREATE TABLE IF NOT EXISTS merchant_vectors (model TEXT, merchant TEXT, vector BLOB, PRIMARY KEY (model, merchant))')
+        return connection
+
+    def _load_stored(self, merchants):
+        if not self.cache_path or not merchants:
+            return {}
+        stored = {}
+        # sqlite3's own context manager only commits; closing() releases the connection
+        with closing(self._connect()) as connection, connection:
+            for start in range(0, len(merchants), 500):
+                batch = merchants[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT merchant, vector FROM merchant_vectors WHERE model = ? AND merchant IN ({','.join('?' * len(batch))})",
+                    [self._model_id, *batch]
+                )
+                for merchant, vector in rows:
+                    stored[merchant] = np.frombuffer(vector, dtype=np.float32)
+        return stored
+
+    def _store(self, vectors):
+        if not self.cache_path or not vectors:
+            return
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                'INSERT OR IGNORE INTO merchant_vectors (model, merchant, vector) VALUES (?, ?, ?)',
+                [(self._model_id, merchant, vector.astype(np.float32).tobytes()) for merchant, vector in vectors.items()]
+            )
+
+    def _embed(self, merchants):
+        # One gather over the vocabulary for the whole batch; a merchant is the mean of its known words
+        model = self._model
+        token_indices, owners = [], []
+        for position, merchant in enumerate(merchants):
+            for word in merchant.split():
+                index = model.key_to_index.get(word)
+                if index is not None:
+                    token_indices.append(index)
+                    owners.append(position)
+        vectors = np.zeros((len(merchants), model.vectors.shape[1]), dtype=np.float32)
+        if token_indices:
+            np.add.at(vectors, np.asarray(owners), _unit(np.asarray(model.vectors[np.asarray(token_indices)], dtype=np.float32)))
+        return dict(zip(merchants, vectors))
+
+    @timed("categorize.merchant_vectors")
+    def merchant_vectors(self, merchants):
+        # LRU first, then the on-disk store, then the model for whatever is left
+        found, missing = {}, []
+        with self._lock:
+            for merchant in merchants:
+                vector = self._vectors.get(merchant)
+                if vector is None:
+                    missing.append(merchant)
+                else:
+                    self._vectors.move_to_end(merchant)
+                    found[merchant] = vector
+
+        stored = self._load_stored(missing)
+        embedded = self._embed([merchant for merchant in missing if merchant not in stored])
+        self._store(embedded)
+
+        with self._lock:
+            for merchant, vector in {**stored, **embedded}.items():
+                self._vectors[merchant] = vector
+                self._vectors.move_to_end(merchant)
+            while len(self._vectors) > self.cache_size:
+                self._vectors.popitem(last=False)
+        return {**found, **stored, **embedded}
+
+    @timed("categorize.categorize_merchants")
+    def categorize(self, merchants):
+        # Category per merchant by cosine similarity to the nearest centroid; None when nothing is close enough
+        if not self.available() or self._load() is None or not self._categories:
+            return [None] * len(merchants)
+        # Rows repeat merchants heavily, so all work below is per distinct merchant
+        normalized = {merchant: normalize_merchant(merchant) for merchant in dict.fromkeys(merchants)}
+        unique = list(dict.fromkeys(normalized.values()))
+        vectors = self.merchant_vectors(unique)
+        matrix = _unit(np.asarray([vectors[merchant] for merchant in unique], dtype=np.float32))
+        similarities = matrix @ self._centroids.T
+        best = similarities.argmax(axis=1)
+        scores = similarities[np.arange(len(unique)), best]
+        categories = {
+            merchant: self._categories[index] if score >= self.min_similarity else None
+            for merchant, index, score in zip(unique, best, scores)
+        }
+        return [categories[normalized[merchant]] for merchant in merchants]
+
+
+def _unit(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+merchant_categorizer = MerchantCategorizer(
+    Config.CATEGORY_MODEL_PATH,
+    Config.MERCHANT_VECTOR_CACHE_PATH,
+    Config.MERCHANT_VECTOR_CACHE_SIZE,
+    Config.CATEGORY_MIN_SIMILARITY
+)
@@ -1,49 +1,140 @@
 import pandas as pd
 import numpy as np
 import logging
+from app.utils.metrics import timed
+from app.utils.quantile_sketch import flag_transactions
 
 
-def get_historical_average_spending(df, year, month, week_of_month):
-    previous_data = df[(df['year'] != year) | (df['month'] != month)]
-    week_data = previous_data[previous_data['week_of_month'] == week_of_month]
-    if not week_data.empty:
-        return week_data[week_data['amount'] < 0]['amount'].mean()
-    return 0
+def _previous_weeks(weekly, year, month, week_of_month):
+    previous_data = weekly[(weekly['year'] != year) | (weekly['month'] != month)]
+    return previous_data[previous_data['week_of_month'] == week_of_month]
 
-def get_current_week_spending(df, year, month, week_of_month):
-    current_week_data = df[(df['year'] == year) & (df['month'] == month) & (df['week_of_month'] == week_of_month)]
-    return current_week_data[current_week_data['amount'] < 0]['amount'].sum()
+def _current_week(weekly, year, month, week_of_month):
+    return weekly[(weekly['year'] == year) & (weekly['month'] == month) & (weekly['week_of_month'] == week_of_month)]
 
-def get_historical_average_earnings(df, year, month, week_of_month):
-    previous_data = df[(df['year'] != year) | (df['month'] != month)]
-    week_data = previous_data[previous_data['week_of_month'] == week_of_month]
-    if not week_data.empty:
-        return week_data[week_data['amount'] > 0]['amount'].mean()
+@timed("analyzer.get_historical_average_spending")
+def get_historical_average_spending(weekly, year, month, week_of_month):
+    week_data = _previous_weeks(weekly, year, month, week_of_month)
+    spend_count = week_data['spend_count'].sum()
+    if spend_count > 0:
+        return week_data['spent'].sum() / spend_count
     return 0
 
-def get_current_week_earnings(df, year, month, week_of_month):
-    current_week_data = df[(df['year'] == year) & (df['month'] == month) & (df['week_of_month'] == week_of_month)]
-    return current_week_data[current_week_data['amount'] > 0]['amount'].sum()
-
-def get_monthly_totals(df, year, month):
-    current_month_data = df[(df['year'] == year) & (df['month'] == month)]
-    total_spent = current_month_data[current_month_data['amount'] < 0]['amount'].sum()
-    total_earned = current_month_data[current_month_data['amount'] > 0]['amount'].sum()
-    return total_spent, total_earned
-
-def get_overall_totals(df):
-    total_spent = df[df['amount'] < 0]['amount'].sum()
-    total_earned = df[df['amount'] > 0]['amount'].sum()
-    return total_spent, total_earned
-
-def get_historical_monthly_totals(df, year, month):
-    previous_data = df[(df['year'] != year) | (df['month'] != month)]
-    total_spent = previous_data[previous_data['amount'] < 0]['amount'].sum()
-    total_earned = previous_data[previous_data['amount'] > 0]['amount'].sum()
-    return total_spent, total_earned
-
+@timed("analyzer.get_current_week_spending")
+def get_current_week_spending(weekly, year, month, week_of_month):
+    return _current_week(weekly, year, month, week_of_month)['spent'].sum()
 
+@timed("analyzer.get_historical_average_earnings")
+def get_historical_average_earnings(weekly, year, month, week_of_month):
+    week_data = _previous_weeks(weekly, year, month, week_of_month)
+    earn_count = week_data['earn_count'].sum()
+    if earn_count > 0:
+        return week_data['earned'].sum() / earn_count
+    return 0
 
+@timed("analyzer.get_current_week_earnings")
+def get_current_week_earnings(weekly, year, month, week_of_month):
+    return _current_week(weekly, year, month, week_of_month)['earned'].sum()
+
+@timed("analyzer.get_monthly_totals")
+def get_monthly_totals(monthly, year, month):
+    current_month_data = monthly[(monthly['year'] == year) & (monthly['month'] == month)]
+    return current_month_data['spent'].sum(), current_month_data['earned'].sum()
+
+@timed("analyzer.get_overall_totals")
+def get_overall_totals(overall):
+    return overall['spent'], overall['earned']
+
+@timed("analyzer.get_historical_monthly_totals")
+def get_historical_monthly_totals(monthly, year, month):
+    previous_data = monthly[(monthly['year'] != year) | (monthly['month'] != month)]
+    return previous_data['spent'].sum(), previous_data['earned'].sum()
+
+
+
+@timed("analyzer.analyze_transactions_batch")
+def analyze_transactions_batch(transactions, weekly, monthly, overall, thresholds=None):
+    # Same figures as the per-transaction functions above, computed once per distinct week and joined back
+    totals = ['spent', 'earned', 'spend_count', 'earn_count']
+    week_keys = ['year', 'month', 'week_of_month']
+    month_keys = ['year', 'month']
+
+    weekly = weekly[week_keys + totals].astype(float)
+    monthly = monthly[month_keys + totals].astype(float)
+    same_week = weekly.groupby('week_of_month', as_index=False)[totals].sum()
+    same_week.columns = ['week_of_month'] + [f'week_total_{column}' for column in totals]
+    month_totals = monthly.rename(columns={column: f'month_{column}' for column in totals})
+
+    frame = transactions[['transaction_id'] + week_keys].astype({key: float for key in week_keys})
+    frame = frame.merge(weekly, on=week_keys, how='left')
+    frame = frame.merge(same_week, on='week_of_month', how='left')
+    frame = frame.merge(month_totals, on=month_keys, how='left')
+    frame = frame.fillna(0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spend_count = frame['week_total_spend_count'] - frame['spend_count']
+        earn_count = frame['week_total_earn_count'] - frame['earn_count']
+        historical_avg_spending = np.where(spend_count > 0, (frame['week_total_spent'] - frame['spent']) / spend_count, 0)
+        historical_avg_earnings = np.where(earn_count > 0, (frame['week_total_earned'] - frame['earned']) / earn_count, 0)
+
+    overall_spending, overall_earnings = get_overall_totals(overall)
+    result = pd.DataFrame({
+        "transaction_id": frame['transaction_id'],
+        "historical_average_spending": historical_avg_spending,
+        "current_week_spending": frame['spent'],
+        "spending_comparison": frame['spent'] - historical_avg_spending,
+        "historical_average_earnings": historical_avg_earnings,
+        "current_week_earnings": frame['earned'],
+        "earnings_comparison": frame['earned'] - historical_avg_earnings,
+        "current_month_spending": frame['month_spent'],
+        "current_month_earnings": frame['month_earned'],
+        "historical_month_spending": monthly['spent'].sum() - frame['month_spent'],
+        "historical_month_earnings": monthly['earned'].sum() - frame['month_earned'],
+        "overall_spending": overall_spending,
+        "overall_earnings": overall_earnings
+    })
+    if thresholds is not None:
+        flags = flag_transactions(transactions, thresholds)
+        result['is_high_value'] = flags['is_high_value'].to_numpy()
+        result['is_outlier'] = flags['is_outlier'].to_numpy()
+    return result.to_dict("records")
+
+
+
+# Numeric analysis fields the trend engine can follow across analyses
+TREND_METRICS = [
+    'historical_average_spending', 'current_week_spending', 'spending_comparison',
+    'historical_average_earnings', 'current_week_earnings', 'earnings_comparison',
+    'current_month_spending', 'current_month_earnings', 'historical_month_spending',
+    'historical_month_earnings', 'overall_spending', 'overall_earnings',
+]
+
+@timed("analyzer.compute_trends")
+def compute_trends(values, window):
+    # values: one row per analysis in series order, one column per metric; NaN marks a missing field
+    values = np.asarray(values, dtype=float)
+    if window < 1:
+        raise ValueError("window must be at least 1")
+
+    deltas = np.full_like(values, np.nan)
+    deltas[1:] = values[1:] - values[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent_changes = np.full_like(values, np.nan)
+        percent_changes[1:] = np.where(values[:-1] != 0, deltas[1:] / np.abs(values[:-1]) * 100, np.nan)
+
+        # Rolling mean over the last `window` analyses from running sums; NaN until the window is full
+        present = ~np.isnan(values)
+        sums = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(np.where(present, values, 0), axis=0)])
+        counts = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(present, axis=0)])
+        ends = np.arange(1, len(values) + 1)
+        starts = np.maximum(ends - window, 0)
+        window_counts = counts[ends] - counts[starts]
+        rolling_means = np.where(window_counts > 0, (sums[ends] - sums[starts]) / window_counts, np.nan)
+        rolling_means[:window - 1] = np.nan
+
+    return {"deltas": deltas, "rolling_means": rolling_means, "percent_changes": percent_changes}
+
+@timed("analyzer.compare_last_three_analyses")
 def compare_last_three_analyses(analyses):
     logger = logging.getLogger(__name__)
     logger.debug(f"Retrieved analyses: {analyses}")
@@ -51,34 +142,29 @@ def compare_last_three_analyses(analyses):
     if len(analyses) < 3:
         raise ValueError("Not enough analyses to compare. At least 3 analyses are required.")
 
+    # The three-analysis window of the trend engine, in the order the analyses were given
+    metrics = {
+        "spending_comparison": "current_week_spending",
+        "earnings_comparison": "current_week_earnings",
+        "monthly_spending_comparison": "current_month_spending",
+        "monthly_earnings_comparison": "current_month_earnings",
+    }
+    values = [[analysis[metric] for metric in metrics.values()] for analysis in analyses]
+    deltas = compute_trends(values, 3)["deltas"].tolist()
+
     comparison_results = []
 
     for i in range(len(analyses) - 2):
-        analysis1 = analyses[i]
-        analysis2 = analyses[i + 1]
-        analysis3 = analyses[i + 2]
-
         comparison = {
-            "analysis1": analysis1,
-            "analysis2": analysis2,
-            "analysis3": analysis3,
-            "spending_comparison": {
-                "analysis1_vs_analysis2": analysis2["current_week_spending"] - analysis1["current_week_spending"],
-                "analysis2_vs_analysis3": analysis3["current_week_spending"] - analysis2["current_week_spending"]
-            },
-            "earnings_comparison": {
-                "analysis1_vs_analysis2": analysis2["current_week_earnings"] - analysis1["current_week_earnings"],
-                "analysis2_vs_analysis3": analysis3["current_week_earnings"] - analysis2["current_week_earnings"]
-            },
-            "monthly_spending_comparison": {
-                "analysis1_vs_analysis2": analysis2["current_month_spending"] - analysis1["current_month_spending"],
-                "analysis2_vs_analysis3": analysis3["current_month_spending"] - analysis2["current_month_spending"]
-            },
-            "monthly_earnings_comparison": {
-                "analysis1_vs_analysis2": analysis2["current_month_earnings"] - analysis1["current_month_earnings"],
-                "analysis2_vs_analysis3": analysis3["current_month_earnings"] - analysis2["current_month_earnings"]
-            }
+            "analysis1": analyses[i],
+            "analysis2": analyses[i + 1],
+            "analysis3": analyses[i + 2],
         }
+        for column, name in enumerate(metrics):
+            comparison[name] = {
+                "analysis1_vs_analysis2": deltas[i + 1][column],
+                "analysis2_vs_analysis3": deltas[i + 2][column]
+            }
 
         comparison_results.append(comparison)
 
@@ -1,8 +1,24 @@
 from app.database.mongo import db
+from app.utils.metrics import timed
 
-def save_interpretation(transaction_id: str, narratives: dict):
+@timed("mongo.save_interpretation")
+def save_interpretation(transaction_id: str, narratives: dict, cache_keys: dict = None):
     document = {
         "transaction_id": transaction_id,
         "narratives": narratives
     }
-    db.analysis_interpretations_collection.insert_one(document)
\ No newline at end of file
+    if cache_keys:
+        document["cache_keys"] = cache_keys
+    db.analysis_interpretations_collection.insert_one(document)
+
+@timed("mongo.find_cached_narrative")
+def find_cached_narrative(version: str, cache_key: str):
+    # Most recent stored narrative generated for this content address
+    document = db.analysis_interpretations_collection.find_one(
+        {f"cache_keys.{version}": cache_key, f"narratives.{version}": {"$ne": ""}},
+        {f"narratives.{version}": 1},
+        sort=[("_id", -1)]
+    )
+    if document is None:
+        return None
+    return document["narratives"][version]
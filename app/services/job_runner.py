@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from app.config import Config
+from app.database.mongo import run_db
+from app.services.aggregate_service import get_weekly_aggregates, get_monthly_aggregates, get_overall_aggregate
+from app.services.financial_analyzer import analyze_transactions_batch
+from app.services.sketch_service import get_amount_thresholds
+from app.services.job_service import (
+    COMPLETED, FAILED, claim_next_job, renew_lease, update_job_progress, mark_transactions_saved,
+    finish_job, release_job, download_job_upload
+)
+from app.services.transaction_service import save_transaction, get_total_transaction_count, save_analyses, find_known_transaction_ids
+from app.services.upload_service import record_upload, upload_counts
+from app.utils.data_processing import preprocess_csv_file, read_transaction_ids
+
+logger = logging.getLogger(__name__)
+
+
+# Claims upload jobs from Mongo and runs their CPU-heavy steps in a process pool
+class JobRunner:
+    def __init__(self, concurrency, process_workers, poll_interval):
+        self.concurrency = concurrency
+        self.process_workers = process_workers
+        self.poll_interval = poll_interval
+        self.pool = None
+        self._active = 0
+        self._wake = None
+        self._poller = None
+        self._tasks = set()
+
+    def start(self):
+        # spawn, not fork: the parent holds pymongo clients and threads that must not be copied
+        self.pool = ProcessPoolExecutor(max_workers=self.process_workers, mp_context=multiprocessing.get_context('spawn'))
+        self._wake = asyncio.Event()
+        self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._poller is None:
+            return
+        self._poller.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(self._poller, *self._tasks, return_exceptions=True)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self._poller = None
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _poll(self):
+        # Also picks up jobs queued by other replicas and jobs left behind by a crashed process
+        while True:
+            while self._active < self.concurrency:
+                job = await run_db(claim_next_job)
+                if job is None:
+                    break
+                self._active += 1
+                task = asyncio.create_task(self._run(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _heartbeat(self, job_id, runner):
+        # Returns only after the lease is lost, having cancelled the run it was renewing
+        while True:
+            await asyncio.sleep(Config.JOB_LEASE_SECONDS / 3)
+            try:
+                renewed = await run_db(renew_lease, job_id)
+            except Exception:
+                logger.exception("Could not renew the lease on job %s", job_id)
+                continue
+            if not renewed:
+                logger.warning("Lost the lease on job %s, another process may own it now", job_id)
+                runner.cancel()
+                return
+
+    async def _run(self, job):
+        heartbeat = asyncio.create_task(self._heartbeat(job['_id'], asyncio.current_task()))
+        try:
+            result = await self._process(job)
+            finished = await run_db(finish_job, job, COMPLETED, result=result)
+            if finished and job.get('fingerprint'):
+                await run_db(record_upload, job['fingerprint'], job['uuid'], analyzed='analyses' in result, message=result.get('message'), job_id=job['_id'])
+        except asyncio.CancelledError:
+            if heartbeat.done():
+                # Lost the lease: whoever claimed the job finishes it
+                return
+            # Shutdown: hand the job back so another process resumes it without waiting out the lease
+            await run_db(release_job, job)
+            raise
+        except Exception as e:
+            logger.exception("Job %s failed", job['_id'])
+            await run_db(finish_job, job, FAILED, error=str(e))
+        finally:
+            heartbeat.cancel()
+            self._active -= 1
+            self.wake()
+
+    async def _process(self, job):
+        loop = asyncio.get_running_loop()
+        job_id = job['_id']
+        unique_id = job['uuid']
+        path = await run_db(download_job_upload, job)
+        try:
+            # Rows stored by other uploads are skipped before preprocessing. Rows this job stored before
+            # it was interrupted are kept, so a resumed job still analyzes them
+            await run_db(update_job_progress, job_id, stage='deduplicating')
+            transaction_ids = await loop.run_in_executor(self.pool, read_transaction_ids, path)
+            known_ids = await run_db(find_known_transaction_ids, transaction_ids, unique_id)
+            await run_db(update_job_progress, job_id, stage='preprocessing')
+            df, skipped_rows, rejected_rows = await loop.run_in_executor(self.pool, preprocess_csv_file, path, known_ids)
+        finally:
+            os.remove(path)
+        counts = upload_counts(skipped_rows, rejected_rows)
+
+        if df.empty:
+            return {
+                "uuid": unique_id,
+                "rows": 0,
+                **counts,
+                "message": "No new transactions, every row with a transaction_id is already saved."
+            }
+
+        # Saving is idempotent, but a resumed job can skip the round trip entirely
+        if not job.get('transactions_saved'):
+            await run_db(update_job_progress, job_id, stage='saving_transactions', rows=len(df))
+            await run_db(save_transaction, df, unique_id)
+            await run_db(mark_transactions_saved, job_id)
+
+        if await run_db(get_total_transaction_count) < 30:
+            return {
+                "uuid": unique_id,
+                "rows": len(df),
+                **counts,
+                "message": "Not enough data to give analysis, but the data is saved to the database."
+            }
+
+        await run_db(update_job_progress, job_id, stage='analyzing')
+        weekly, monthly, overall, thresholds = await asyncio.gather(
+            run_db(get_weekly_aggregates),
+            run_db(get_monthly_aggregates),
+            run_db(get_overall_aggregate),
+            run_db(get_amount_thresholds)
+        )
+        comparisons = await loop.run_in_executor(self.pool, analyze_transactions_batch, df, weekly, monthly, overall, thresholds)
+        for comparison in comparisons:
+            comparison['uuid'] = unique_id
+
+        await run_db(update_job_progress, job_id, stage='saving_analyses', analyses=len(comparisons))
+        failed_analyses = await run_db(save_analyses, comparisons)
+        return {
+            "uuid": unique_id,
+            "rows": len(df),
+            **counts,
+            "analyses": len(comparisons) - len(failed_analyses),
+            "failed_analyses": failed_analyses[:100]
+        }
+
+
+job_runner = JobRunner(Config.JOB_CONCURRENCY, Config.JOB_PROCESS_WORKERS, Config.JOB_POLL_INTERVAL)
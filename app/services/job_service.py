@@ -0,0 +1,130 @@
+import os
+import socket
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+import gridfs
+from pymongo import ReturnDocument
+from app.config import Config
+from app.database.mongo import db
+
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+uploads = gridfs.GridFS(db, collection='job_uploads')
+
+# Identifies this process as the owner of the jobs it claims
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def count_queued_jobs():
+    return db.jobs.count_documents({'status': PENDING})
+
+
+def create_job(fileobj, filename, fingerprint=None):
+    # The upload goes to GridFS so whichever replica claims the job can read it
+    file_id = uploads.put(fileobj, filename=filename)
+    now = datetime.utcnow()
+    job = {
+        '_id': str(uuid.uuid4()),
+        'uuid': str(uuid.uuid4()),
+        'status': PENDING,
+        'filename': filename,
+        'fingerprint': fingerprint,
+        'file_id': file_id,
+        'progress': {'stage': 'queued'},
+        'created_at': now,
+        'updated_at': now,
+        'lease_expires_at': None,
+        'owner': None
+    }
+    db.jobs.insert_one(job)
+    return job
+
+
+def claim_next_job():
+    # Oldest pending job, or a running job whose owner stopped renewing its lease
+    now = datetime.utcnow()
+    return db.jobs.find_one_and_update(
+        {'$or': [
+            {'status': PENDING},
+            {'status': RUNNING, 'lease_expires_at': {'$lt': now}}
+        ]},
+        {
+            '$set': {
+                'status': RUNNING,
+                'owner': WORKER_ID,
+                'lease_expires_at': now + timedelta(seconds=Config.JOB_LEASE_SECONDS),
+                'updated_at': now
+            },
+            '$inc': {'attempts': 1}
+        },
+        sort=[('created_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def renew_lease(job_id):
+    now = datetime.utcnow()
+    result = db.jobs.update_one(
+        {'_id': job_id, 'owner': WORKER_ID, 'status': RUNNING},
+        {'$set': {'lease_expires_at': now + timedelta(seconds=Config.JOB_LEASE_SECONDS), 'updated_at': now}}
+    )
+    return result.modified_count == 1
+
+
+def update_job_progress(job_id, **progress):
+    db.jobs.update_one(
+        {'_id': job_id, 'owner': WORKER_ID},
+        {'$set': {**{f'progress.{key}': value for key, value in progress.items()}, 'updated_at': datetime.utcnow()}}
+    )
+
+
+def mark_transactions_saved(job_id):
+    db.jobs.update_one({'_id': job_id, 'owner': WORKER_ID}, {'$set': {'transactions_saved': True}})
+
+
+def finish_job(job, status, result=None, error=None):
+    # False when another process took the job over; its run still needs the upload
+    update = {'status': status, 'progress.stage': status, 'updated_at': datetime.utcnow(), 'lease_expires_at': None}
+    if result is not None:
+        update['result'] = result
+    if error is not None:
+        update['error'] = error
+    finished = db.jobs.update_one({'_id': job['_id'], 'owner': WORKER_ID, 'status': RUNNING}, {'$set': update})
+    if finished.modified_count != 1:
+        return False
+    uploads.delete(job['file_id'])
+    return True
+
+
+def release_job(job):
+    # Puts an interrupted job straight back in the queue instead of waiting out its lease
+    db.jobs.update_one(
+        {'_id': job['_id'], 'owner': WORKER_ID, 'status': RUNNING},
+        {'$set': {'status': PENDING, 'owner': None, 'lease_expires_at': None, 'progress.stage': 'queued', 'updated_at': datetime.utcnow()}}
+    )
+
+
+def download_job_upload(job):
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as target:
+        source = uploads.get(job['file_id'])
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            target.write(chunk)
+    return target.name
+
+
+def get_job(job_id):
+    job = db.jobs.find_one({'_id': job_id}, {'file_id': 0, 'fingerprint': 0, 'lease_expires_at': 0, 'owner': 0})
+    if job is not None:
+        job['job_id'] = job.pop('_id')
+    return job
+
+
+def get_job_results(unique_id, skip=0, limit=100):
+    analyses = list(db.analysis.find({'uuid': unique_id}).sort('_id', 1).skip(skip).limit(limit))
+    for analysis in analyses:
+        analysis['_id'] = str(analysis['_id'])
+    return analyses
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from app.config import Config
+from app.utils.metrics import NARRATIVE_CACHE_LOOKUPS
+from app.utils.prompts import PROMPT_TEMPLATE_VERSION
+
+
+def narrative_cache_key(model, version, prompt):
+    # Content address of one narrative: model, prompt strategy and the rendered prompt, plus the cache-busting template version
+    canonical = json.dumps(
+        {"model": model, "version": version, "template_version": PROMPT_TEMPLATE_VERSION, "prompt": prompt},
+        sort_keys=True,
+        separators=(',', ':'),
+        default=str
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class NarrativeCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "store_hits": 0, "misses": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            narrative, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return narrative
+
+    def put(self, key, narrative):
+        # An empty narrative means the completion produced nothing; it must not be replayed as a hit
+        if self.max_size <= 0 or not narrative:
+            return
+        with self._lock:
+            self._entries[key] = (narrative, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def record(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+        NARRATIVE_CACHE_LOOKUPS.inc(outcome=outcome)
+
+    def snapshot(self):
+        with self._lock:
+            lookups = sum(self.stats.values())
+            hits = self.stats["memory_hits"] + self.stats["store_hits"]
+            return {
+                **self.stats,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hit_ratio": hits / lookups if lookups else 0.0
+            }
+
+
+narrative_cache = NarrativeCache(Config.NARRATIVE_CACHE_SIZE, Config.NARRATIVE_CACHE_TTL)
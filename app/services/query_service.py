@@ -0,0 +1,72 @@
+from datetime import datetime
+from app.database.mongo import db
+from app.utils.metrics import timed
+
+
+def _date_match(start_date=None, end_date=None):
+    date_range = {}
+    if start_date:
+        date_range['$gte'] = datetime.strptime(start_date, '%Y-%m-%d')
+    if end_date:
+        date_range['$lte'] = datetime.strptime(end_date, '%Y-%m-%d')
+    return {'date': date_range} if date_range else {}
+
+
+def spending_by_category_pipeline(start_date=None, end_date=None):
+    return [
+        {'$match': {'amount': {'$lt': 0}, **_date_match(start_date, end_date)}},
+        {'$project': {'_id': 0, 'year': 1, 'month': 1, 'category': 1, 'amount': 1}},
+        {'$group': {
+            '_id': {'year': '$year', 'month': '$month', 'category': '$category'},
+            'total_spent': {'$sum': '$amount'},
+            'transactions': {'$sum': 1}
+        }},
+        {'$project': {'_id': 0, 'year': '$_id.year', 'month': '$_id.month', 'category': '$_id.category', 'total_spent': 1, 'transactions': 1}},
+        {'$sort': {'year': 1, 'month': 1, 'total_spent': 1}}
+    ]
+
+
+def earnings_by_region_pipeline(start_date=None, end_date=None):
+    return [
+        {'$match': {'amount': {'$gt': 0}, **_date_match(start_date, end_date)}},
+        {'$project': {'_id': 0, 'region': 1, 'amount': 1}},
+        {'$group': {
+            '_id': '$region',
+            'total_earned': {'$sum': '$amount'},
+            'transactions': {'$sum': 1}
+        }},
+        {'$project': {'_id': 0, 'region': '$_id', 'total_earned': 1, 'transactions': 1}},
+        {'$sort': {'total_earned': -1}}
+    ]
+
+
+def top_merchants_pipeline(limit=10, start_date=None, end_date=None):
+    return [
+        {'$match': {'amount': {'$lt': 0}, **_date_match(start_date, end_date)}},
+        {'$project': {'_id': 0, 'merchant': 1, 'amount': 1}},
+        {'$group': {
+            '_id': '$merchant',
+            'total_spent': {'$sum': '$amount'},
+            'transactions': {'$sum': 1}
+        }},
+        {'$sort': {'total_spent': 1}},
+        {'$limit': limit},
+        {'$project': {'_id': 0, 'merchant': '$_id', 'total_spent': 1, 'transactions': 1}}
+    ]
+
+
+@timed("mongo.run_breakdown")
+def run_breakdown(pipeline):
+    return list(db.transactions.aggregate(pipeline, allowDiskUse=True))
+
+
+def get_spending_by_category(start_date=None, end_date=None):
+    return run_breakdown(spending_by_category_pipeline(start_date, end_date))
+
+
+def get_earnings_by_region(start_date=None, end_date=None):
+    return run_breakdown(earnings_by_region_pipeline(start_date, end_date))
+
+
+def get_top_merchants(limit=10, start_date=None, end_date=None):
+    return run_breakdown(top_merchants_pipeline(limit, start_date, end_date))
@@ -0,0 +1,71 @@
+from app.config import Config
+from app.database.mongo import db
+import pandas as pd
+from pymongo import UpdateOne
+from app.utils.metrics import timed
+from app.utils.quantile_sketch import OVERALL_SCOPE, bucket_counts, amount_thresholds
+
+
+def _sketch_id(category, side):
+    return f"{side}:overall" if category is OVERALL_SCOPE else f"{side}:category:{category}"
+
+
+def _apply_counts(counts):
+    # Sketches merge by adding bucket counts, so concurrent uploads only need $inc
+    operations = [
+        UpdateOne(
+            {'_id': _sketch_id(category, side)},
+            {
+                '$inc': {'count': sum(buckets.values()), **{f'buckets.{bucket}': count for bucket, count in buckets.items()}},
+                '$setOnInsert': {'category': category, 'side': side}
+            },
+            upsert=True
+        )
+        for (category, side), buckets in counts.items()
+    ]
+    if operations:
+        db.amount_sketches.bulk_write(operations, ordered=False)
+
+
+@timed("mongo.update_amount_sketches")
+def update_amount_sketches(transactions):
+    if transactions.empty:
+        return
+    _apply_counts(bucket_counts(transactions, Config.SKETCH_RELATIVE_ACCURACY))
+
+
+@timed("mongo.update_record_sketches")
+def update_record_sketches(record):
+    _apply_counts(bucket_counts(pd.DataFrame([record], columns=['amount', 'category']), Config.SKETCH_RELATIVE_ACCURACY))
+
+
+@timed("mongo.get_amount_thresholds")
+def get_amount_thresholds():
+    # {(category or None, side): {'high', 'lower', 'upper'}}; categories with too little history are left out
+    thresholds = {}
+    for sketch in db.amount_sketches.find({}):
+        if sketch['category'] is not OVERALL_SCOPE and sketch['count'] < Config.SKETCH_MIN_COUNT:
+            continue
+        buckets = {int(bucket): count for bucket, count in sketch['buckets'].items() if count > 0}
+        if buckets:
+            thresholds[(sketch['category'], sketch['side'])] = amount_thresholds(buckets, Config.SKETCH_RELATIVE_ACCURACY)
+    return thresholds
+
+
+@timed("mongo.rebuild_amount_sketches")
+def rebuild_amount_sketches(batch_size=100000):
+    # Recompute the sketches from the raw transactions, e.g. after changing SKETCH_RELATIVE_ACCURACY
+    db.amount_sketches.delete_many({})
+    cursor = db.transactions.find({}, {'_id': 0, 'amount': 1, 'category': 1}).batch_size(batch_size)
+    total = 0
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) == batch_size:
+            update_amount_sketches(pd.DataFrame(batch, columns=['amount', 'category']))
+            total += len(batch)
+            batch = []
+    if batch:
+        update_amount_sketches(pd.DataFrame(batch, columns=['amount', 'category']))
+        total += len(batch)
+    return total
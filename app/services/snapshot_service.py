@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from bson import ObjectId
+from app.config import Config
+from app.database.mongo import db
+from app.services.aggregate_service import aggregate_weekly, MONTH_KEYS, TOTAL_FIELDS
+
+STATE_FILE = '_export_state.json'
+PARTITION_COLUMNS = ['year', 'month']
+
+SNAPSHOT_SCHEMA = pa.schema([
+    ('_id', pa.string()),
+    ('transaction_id', pa.string()),
+    ('date', pa.timestamp('ms')),
+    ('amount', pa.float64()),
+    ('merchant', pa.dictionary(pa.int32(), pa.string())),
+    ('category', pa.dictionary(pa.int32(), pa.string())),
+    ('city', pa.dictionary(pa.int32(), pa.string())),
+    ('region', pa.dictionary(pa.int32(), pa.string())),
+    ('payment_method', pa.dictionary(pa.int32(), pa.string())),
+    ('day_of_week', pa.int8()),
+    ('week_of_month', pa.int8()),
+    ('month', pa.int8()),
+    ('year', pa.int16()),
+    ('uuid', pa.string()),
+])
+
+PARTITIONING = ds.partitioning(pa.schema([('year', pa.int16()), ('month', pa.int8())]), flavor='hive')
+
+
+def _read_state(directory):
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_state(directory, state):
+    path = os.path.join(directory, STATE_FILE)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(state, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _to_table(records):
+    frame = pd.DataFrame(records).reindex(columns=SNAPSHOT_SCHEMA.names)
+    frame['_id'] = frame['_id'].astype(str)
+    frame['date'] = pd.to_datetime(frame['date'])
+    for column in ('merchant', 'category', 'city', 'region', 'payment_method', 'transaction_id', 'uuid'):
+        frame[column] = frame[column].where(frame[column].notna(), None).astype(object)
+    return pa.Table.from_pandas(frame, schema=SNAPSHOT_SCHEMA, preserve_index=False)
+
+
+def export_transactions_snapshot(directory=None, full=False, batch_size=100_000):
+    # Append transactions newer than the last exported _id as year/month partitioned Parquet
+    directory = directory or Config.SNAPSHOT_DIR
+    if full and os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory, exist_ok=True)
+
+    state = _read_state(directory)
+    query = {'_id': {'$gt': ObjectId(state['last_id'])}} if state.get('last_id') else {}
+    cursor = db.transactions.find(query, {field: 1 for field in SNAPSHOT_SCHEMA.names}).sort('_id', 1).batch_size(batch_size)
+
+    exported = 0
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) == batch_size:
+            exported += _write_batch(directory, state, batch)
+            batch = []
+    if batch:
+        exported += _write_batch(directory, state, batch)
+    return exported
+
+
+def _write_batch(directory, state, batch):
+    ds.write_dataset(
+        _to_table(batch),
+        directory,
+        format='parquet',
+        partitioning=PARTITIONING,
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore'
+    )
+    # Only advance the watermark once the batch is on disk
+    state['last_id'] = str(batch[-1]['_id'])
+    state['exported'] = state.get('exported', 0) + len(batch)
+    _write_state(directory, state)
+    return len(batch)
+
+
+def load_transactions_snapshot(columns=None, filters=None, directory=None):
+    # Column-pruned, memory-mapped read; filters on year/month skip whole partitions
+    directory = directory or Config.SNAPSHOT_DIR
+    table = pq.read_table(
+        directory,
+        columns=columns,
+        filters=filters,
+        memory_map=True,
+        partitioning=PARTITIONING,
+        ignore_prefixes=['_', '.']
+    )
+    return table.to_pandas()
+
+
+def load_snapshot_aggregates(directory=None):
+    # Same shapes as the aggregate store, so the financial_analyzer functions run on the snapshot unchanged
+    transactions = load_transactions_snapshot(columns=['year', 'month', 'week_of_month', 'amount'], directory=directory)
+    weekly = aggregate_weekly(transactions)
+    monthly = weekly.groupby(MONTH_KEYS, as_index=False)[TOTAL_FIELDS].sum()
+    overall = {field: int(weekly[field].sum()) if field.endswith('count') else float(weekly[field].sum()) for field in TOTAL_FIELDS}
+    return weekly, monthly, overall
@@ -1,35 +1,164 @@
 from app.database.mongo import db
+from app.config import Config
+from app.services.aggregate_service import update_aggregates, update_record_aggregates
+from app.services.sketch_service import update_amount_sketches, update_record_sketches
+from app.schemas.frames import transaction_projection, apply_transaction_dtypes, empty_transactions_frame
+from app.utils.data_processing import split_missing_ids, unique_transactions, drop_known_transactions
 import pandas as pd
+import numpy as np
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app.utils.metrics import timed
 
+@timed("mongo.find_known_transaction_ids")
+def find_known_transaction_ids(transaction_ids, unique_id=None, batch_size=50000):
+    # transaction_ids already stored, optionally ignoring the ones stored by upload unique_id
+    query = {} if unique_id is None else {'uuid': {'$ne': unique_id}}
+    known = set()
+    for start in range(0, len(transaction_ids), batch_size):
+        cursor = db.transactions.find(
+            {'transaction_id': {'$in': transaction_ids[start:start + batch_size]}, **query},
+            {'_id': 0, 'transaction_id': 1}
+        )
+        known.update(document['transaction_id'] for document in cursor)
+    return known
+
+def filter_new_transactions(df, unique_id=None):
+    # Only rows with a transaction_id that is new to the database go on to preprocessing and analysis;
+    # also returns how many rows were rejected for having no transaction_id
+    df, rejected_rows = split_missing_ids(df)
+    df = unique_transactions(df)
+    return drop_known_transactions(df, find_known_transaction_ids(df['transaction_id'].tolist(), unique_id)), rejected_rows
+
+@timed("mongo.save_transaction")
 def save_transaction(transactions, unique_id):
+    # Upserts keyed on transaction_id leave stored rows untouched; returns the rows actually inserted
     records = transactions.to_dict("records")
+    operations = []
     for record in records:
         record['uuid'] = unique_id
-    db.transactions.insert_many(records)
+        operations.append(UpdateOne({'transaction_id': record['transaction_id']}, {'$setOnInsert': record}, upsert=True))
+    if not operations:
+        return transactions
+    try:
+        inserted = db.transactions.bulk_write(operations, ordered=False).upserted_ids.keys()
+    except BulkWriteError as e:
+        # A concurrent upload stored the same transaction first
+        if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+            raise
+        inserted = [upsert['index'] for upsert in e.details.get('upserted', [])]
+    new_transactions = transactions.iloc[sorted(inserted)]
+    update_aggregates(new_transactions)
+    update_amount_sketches(new_transactions)
+    return new_transactions
+
+@timed("mongo.save_transaction_record")
+def save_transaction_record(record, unique_id):
+    # False when a transaction with the same transaction_id is already stored
+    record['uuid'] = unique_id
+    try:
+        result = db.transactions.update_one({'transaction_id': record['transaction_id']}, {'$setOnInsert': record}, upsert=True)
+    except DuplicateKeyError:
+        return False
+    if result.upserted_id is None:
+        return False
+    update_record_aggregates(record)
+    update_record_sketches(record)
+    return True
 
 def save_analysis_results(analysis_results, unique_id):
     analysis_results['uuid'] = unique_id
     db.analysis_results.insert_one(analysis_results)
 
-def get_transactions(uuid):
-    return pd.DataFrame(list(db.transactions.find({"uuid": uuid})))
+def _load_transactions(query, columns=None, include_id=False):
+    # Projected cursor straight into the compact dtype schema
+    cursor = db.transactions.find(query, transaction_projection(columns, include_id))
+    df = pd.DataFrame.from_records(cursor)
+    if df.empty:
+        return empty_transactions_frame(columns, include_id)
+    return apply_transaction_dtypes(df)
 
+@timed("mongo.get_transactions")
+def get_transactions(uuid, columns=None, include_id=False):
+    return _load_transactions({"uuid": uuid}, columns, include_id)
+
+@timed("mongo.get_total_transaction_count")
 def get_total_transaction_count():
-    return db.transactions.count_documents({})
+    # Collection metadata count; avoids scanning the collection on every upload
+    return db.transactions.estimated_document_count()
 
-def get_all_transactions():
-    return pd.DataFrame(list(db.transactions.find()))
+@timed("mongo.get_all_transactions")
+def get_all_transactions(columns=None, include_id=False):
+    return _load_transactions({}, columns, include_id)
 
+@timed("mongo.save_analysis")
 def save_analysis(analysis):
     result = db.analysis.insert_one(analysis)
     analysis['_id'] = str(result.inserted_id)  # Convert id to string
     return analysis
 
+@timed("mongo.save_analyses")
+def save_analyses(analyses, batch_size=None):
+    # Write analyses in unordered batches and report the documents that failed
+    batch_size = batch_size or Config.ANALYSIS_BATCH_SIZE
+    failures = []
+    for start in range(0, len(analyses), batch_size):
+        batch = analyses[start:start + batch_size]
+        failed = set()
+        try:
+            db.analysis.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                failed.add(error['index'])
+                failures.append({
+                    "transaction_id": batch[error['index']].get("transaction_id"),
+                    "error": error.get('errmsg')
+                })
+        for index, analysis in enumerate(batch):
+            if index in failed:
+                analysis.pop('_id', None)
+            else:
+                analysis['_id'] = str(analysis['_id'])  # Convert id to string
+    return failures
+
+@timed("mongo.get_upload_analyses")
+def get_upload_analyses(unique_id):
+    analyses = list(db.analysis.find({'uuid': unique_id}).sort('_id', 1))
+    for analysis in analyses:
+        analysis['_id'] = str(analysis['_id'])
+    return analyses
+
+@timed("mongo.remove_duplicate_transactions")
+def remove_duplicate_transactions():
+    # Keeps the first stored copy of every transaction_id; aggregates and sketches need a rebuild afterwards
+    pipeline = [
+        {'$group': {'_id': '$transaction_id', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ]
+    removed = 0
+    for group in db.transactions.aggregate(pipeline, allowDiskUse=True):
+        removed += db.transactions.delete_many({'_id': {'$in': sorted(group['ids'])[1:]}}).deleted_count
+    return removed
+
+@timed("mongo.get_last_n_analyses")
 def get_last_n_analyses(n):
     # Retrieve last n analyses sorted by id in descending order
     analyses = list(db.analysis.find().sort('_id', -1).limit(n))
     # Convert id to string and return results
     for analysis in analyses:
         analysis['_id'] = str(analysis['_id'])
-    return analyses
\ No newline at end of file
+    return analyses
+
+@timed("mongo.get_latest_analysis_id")
+def get_latest_analysis_id():
+    # Covered by the _id index; changes whenever a new analysis is saved
+    latest = db.analysis.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+    return str(latest['_id']) if latest else None
+
+@timed("mongo.get_analysis_series")
+def get_analysis_series(n, metrics):
+    # Last n analyses, oldest first, with only the requested numeric fields
+    cursor = db.analysis.find({}, {metric: 1 for metric in metrics}).sort('_id', -1).limit(n)
+    frame = pd.DataFrame.from_records(cursor, columns=['_id'] + list(metrics)).iloc[::-1]
+    return frame['_id'].astype(str).tolist(), frame[list(metrics)].to_numpy(dtype=float, na_value=np.nan)
@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.config import Config
+from app.services.financial_analyzer import TREND_METRICS, compute_trends
+from app.services.transaction_service import get_latest_analysis_id, get_analysis_series
+from app.utils.metrics import timed
+
+# Built trend responses keyed by the newest analysis id, so saving an analysis invalidates them
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _to_list(column):
+    # NaN is not valid JSON; missing points are returned as null
+    return np.where(np.isnan(column), None, column).tolist()
+
+
+def _build_trends(n, metrics, window):
+    analysis_ids, values = get_analysis_series(n, metrics)
+    trends = compute_trends(values, window)
+    return {
+        "count": len(analysis_ids),
+        "window": window,
+        "analysis_ids": analysis_ids,
+        "metrics": {
+            metric: {
+                "values": _to_list(values[:, column]),
+                "deltas": _to_list(trends["deltas"][:, column]),
+                "rolling_means": _to_list(trends["rolling_means"][:, column]),
+                "percent_changes": _to_list(trends["percent_changes"][:, column])
+            }
+            for column, metric in enumerate(metrics)
+        }
+    }
+
+
+@timed("trends.get_analysis_trends")
+def get_analysis_trends(n, metrics=None, window=3):
+    metrics = list(metrics or TREND_METRICS)
+    unknown = [metric for metric in metrics if metric not in TREND_METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}. Choose from: {', '.join(TREND_METRICS)}")
+    if n < 1 or window < 1:
+        raise ValueError("n and window must be at least 1")
+
+    key = (get_latest_analysis_id(), n, tuple(metrics), window)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    trends = _build_trends(n, metrics, window)
+    with _cache_lock:
+        _cache[key] = trends
+        while len(_cache) > Config.TREND_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return trends
@@ -0,0 +1,44 @@
+import hashlib
+from datetime import datetime
+from pymongo.errors import DuplicateKeyError
+from app.database.mongo import db
+
+MISSING_ID_MESSAGE = "Rows without a transaction_id were rejected and not saved; give every row a transaction_id to upload it."
+
+
+def upload_counts(skipped_rows, rejected_rows):
+    # Rows left out of an upload: already stored (skipped) and without a transaction_id (rejected)
+    counts = {"skipped_rows": skipped_rows, "rejected_rows": rejected_rows}
+    if rejected_rows:
+        counts["rejected_message"] = MISSING_ID_MESSAGE
+    return counts
+
+
+def fingerprint_file(fileobj, chunk_size=1024 * 1024):
+    # sha256 of the uploaded bytes; the file is rewound for the caller
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(chunk_size), b''):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def find_upload(fingerprint):
+    return db.upload_fingerprints.find_one({'_id': fingerprint})
+
+
+def find_upload_by_uuid(unique_id):
+    return db.upload_fingerprints.find_one({'uuid': unique_id})
+
+
+def record_upload(fingerprint, uuid, analyzed, message=None, job_id=None):
+    # First completed upload of these bytes wins; later identical uploads replay its results
+    document = {'uuid': uuid, 'analyzed': analyzed, 'created_at': datetime.utcnow()}
+    if message is not None:
+        document['message'] = message
+    if job_id is not None:
+        document['job_id'] = job_id
+    try:
+        db.upload_fingerprints.update_one({'_id': fingerprint}, {'$setOnInsert': document}, upsert=True)
+    except DuplicateKeyError:
+        pass
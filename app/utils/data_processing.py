@@ -1,6 +1,24 @@
+import math
 import pandas as pd
 import numpy as np
+from datetime import datetime
+from app.utils.metrics import timed
+from app.services.categorization_service import merchant_categorizer
 
+VALID_CITIES = {
+    'Philadelphia': 'PA',
+    'Chicago': 'IL',
+    'New York': 'NY',
+    'Los Angeles': 'CA',
+    'San Jose': 'CA',
+    'San Diego': 'CA',
+    'San Antonio': 'TX',
+    'Phoenix': 'AZ',
+    'Dallas': 'TX',
+    'Houston': 'TX'
+}
+
+@timed("preprocess.process_dates")
 def process_dates(df, date_column='date'):
     df.columns = df.columns.str.strip().str.lower()
     if date_column not in df.columns:
@@ -10,21 +28,30 @@ def process_dates(df, date_column='date'):
     df = df[df[date_column].notnull()]
     return df
 
-def impute_amounts(df, amount_column='amount', category_column='category'):
-    mean_income = df[df[amount_column] > 0][amount_column].mean()
-    median_expense = df[df[amount_column] < 0][amount_column].median()
+@timed("preprocess.impute_amounts")
+def impute_amounts(df, amount_column='amount', category_column='category', mean_income=None, median_expense=None):
+    if mean_income is None:
+        mean_income = df[df[amount_column] > 0][amount_column].mean()
+    if median_expense is None:
+        median_expense = df[df[amount_column] < 0][amount_column].median()
     
     df.loc[df[amount_column].isnull() & (df[category_column] == 'Income'), amount_column] = mean_income
     df.loc[df[amount_column].isnull() & (df[category_column] != 'Income'), amount_column] = median_expense
     return df
 
-def fill_missing_categories(df, amount_column='amount', category_column='category'):
-    most_common_category = df[category_column].mode()[0] if not df[category_column].mode().empty else 'Miscellaneous'
+@timed("preprocess.fill_missing_categories")
+def fill_missing_categories(df, amount_column='amount', category_column='category', most_common_category=None, merchant_column='merchant'):
+    if most_common_category is None:
+        modes = df[category_column].mode()
+        most_common_category = modes[0] if not modes.empty else 'Miscellaneous'
+
+    # Uncategorized expenses go to the category closest to their merchant, when a model is configured
+    if merchant_categorizer.available() and merchant_column in df.columns:
+        missing = df[category_column].isna() & ~(df[amount_column] > 0) & df[merchant_column].notna()
+        if missing.any():
+            df.loc[missing, category_column] = merchant_categorizer.categorize(df.loc[missing, merchant_column].tolist())
 
-    df[category_column] = df.apply(
-        lambda row: 'Income' if row[amount_column] > 0 else (most_common_category if pd.isnull(row[category_column]) else row[category_column]),
-        axis=1
-    )
+    df[category_column] = df[category_column].fillna(most_common_category).mask(df[amount_column] > 0, 'Income')
     return df
 
 def handle_outliers(df, amount_column='amount'):
@@ -48,42 +75,113 @@ def correct_category_names(df, category_column='category'):
     df[category_column] = df[category_column].map(category_mappings).fillna(df[category_column])
     return df
 
+@timed("preprocess.validate_geographic_data")
 def validate_geographic_data(df, city_column='city', region_column='region'):
-    valid_cities = {
-        'Philadelphia': 'PA',
-        'Chicago': 'IL',
-        'New York': 'NY',
-        'Los Angeles': 'CA',
-        'San Jose': 'CA',
-        'San Diego': 'CA',
-        'San Antonio': 'TX',
-        'Phoenix': 'AZ',
-        'Dallas': 'TX',
-        'Houston': 'TX'
-    }
-    df = df[df.apply(lambda row: valid_cities.get(row[city_column]) == row[region_column], axis=1)]
+    df = df[df[city_column].map(VALID_CITIES) == df[region_column]]
     return df
 
+@timed("preprocess.create_derived_features")
 def create_derived_features(df, date_column='date'):
     if date_column not in df.columns:
         raise KeyError(f"'{date_column}' column is missing from the dataframe.")
     
     df['day_of_week'] = df[date_column].dt.dayofweek
-    df['week_of_month'] = df[date_column].apply(lambda x: (x.day - 1) // 7 + 1)
+    df['week_of_month'] = (df[date_column].dt.day - 1) // 7 + 1
     df['month'] = df[date_column].dt.month
     df['year'] = df[date_column].dt.year
-    print(df)
     return df
 
-def preprocess_data(df):
+def _median_from_counts(counts):
+    counts = counts.sort_index()
+    total = int(counts.sum())
+    if total == 0:
+        return np.nan
+    cumulative = counts.cumsum().to_numpy()
+    values = counts.index.to_numpy()
+    lower = values[np.searchsorted(cumulative, (total - 1) // 2, side='right')]
+    upper = values[np.searchsorted(cumulative, total // 2, side='right')]
+    return (lower + upper) / 2
+
+@timed("preprocess.collect_statistics")
+def collect_statistics(chunks, amount_column='amount', category_column='category'):
+    # Whole-dataset imputation statistics gathered one chunk at a time
+    income_sum = 0.0
+    income_count = 0
+    expense_counts = pd.Series(dtype=float)
+    category_counts = pd.Series(dtype=float)
+    for chunk in chunks:
+        chunk = process_dates(chunk)
+        amounts = chunk[amount_column]
+        income = amounts[amounts > 0]
+        income_sum += income.sum()
+        income_count += len(income)
+        expense_counts = expense_counts.add(amounts[amounts < 0].value_counts(), fill_value=0)
+        category_counts = category_counts.add(chunk[category_column].value_counts(), fill_value=0)
+
+    if category_counts.empty:
+        most_common_category = 'Miscellaneous'
+    else:
+        most_common_category = min(category_counts[category_counts == category_counts.max()].index)
+
+    return {
+        'mean_income': income_sum / income_count if income_count else np.nan,
+        'median_expense': _median_from_counts(expense_counts),
+        'most_common_category': most_common_category
+    }
+
+STATISTICS_COLUMNS = {'date', 'amount', 'category'}
+
+def upload_statistics(df):
+    # Taken over every row of an upload before deduplication, so a re-uploaded superset imputes
+    # its new rows exactly as the full file would
+    df.columns = df.columns.str.strip().str.lower()
+    return collect_statistics([df[[column for column in df.columns if column in STATISTICS_COLUMNS]].copy()])
+
+def preprocess_data(df, statistics=None):
+    statistics = statistics or {}
     df.columns = df.columns.str.strip().str.lower()
     df = process_dates(df)
-    df = impute_amounts(df)
-    df = fill_missing_categories(df)
+    df = impute_amounts(df, mean_income=statistics.get('mean_income'), median_expense=statistics.get('median_expense'))
+    df = fill_missing_categories(df, most_common_category=statistics.get('most_common_category'))
     df = validate_geographic_data(df)
     df = create_derived_features(df)
     return df
 
+def split_missing_ids(df, id_column='transaction_id'):
+    # Rows without a transaction_id cannot be deduplicated, so they are rejected instead of stored
+    df.columns = df.columns.str.strip().str.lower()
+    if id_column not in df.columns:
+        raise KeyError(f"'{id_column}' column is missing from the dataframe.")
+    missing = df[id_column].isna()
+    return df[~missing], int(missing.sum())
+
+def unique_transactions(df, id_column='transaction_id'):
+    # Repeats within one upload keep the first row
+    return df.drop_duplicates(subset=id_column)
+
+@timed("preprocess.drop_known_transactions")
+def drop_known_transactions(df, known_ids, id_column='transaction_id'):
+    if not known_ids:
+        return df
+    return df[~df[id_column].isin(list(known_ids))]
+
+def read_transaction_ids(path, id_column='transaction_id'):
+    ids = pd.read_csv(path, usecols=lambda column: column.strip().lower() == id_column).iloc[:, 0]
+    return ids.dropna().unique().tolist()
+
+def preprocess_csv_file(path, known_ids=()):
+    # Top-level so background jobs can run it in a worker process; returns the new rows and the
+    # counts of rows skipped as already stored and rejected for having no transaction_id
+    df = pd.read_csv(path)
+    statistics = upload_statistics(df)
+    df, rejected_rows = split_missing_ids(df)
+    identified_rows = len(df)
+    df = drop_known_transactions(unique_transactions(df), known_ids)
+    skipped_rows = identified_rows - len(df)
+    if not df.empty:
+        df = preprocess_data(df, statistics)
+    return df, skipped_rows, rejected_rows
+
 def preprocess_single_transaction(df):
     df.columns = df.columns.str.strip().str.lower()
     df = process_dates(df)  # Convert date column to datetime
@@ -92,3 +190,38 @@ def preprocess_single_transaction(df):
     df = validate_geographic_data(df)
     df = create_derived_features(df)
     return df
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+@timed("preprocess.preprocess_transaction_record")
+def preprocess_transaction_record(record, statistics=None):
+    # Same rules as preprocess_single_transaction applied to a plain dict; returns None if the record is dropped
+    statistics = statistics or {}
+    record = {str(key).strip().lower(): value for key, value in record.items()}
+    try:
+        date = datetime.strptime(str(record['date']), '%Y-%m-%d')
+    except ValueError:
+        return None
+    record['date'] = date
+
+    amount = record.get('amount')
+    if _is_missing(amount):
+        default = statistics.get('mean_income') if record.get('category') == 'Income' else statistics.get('median_expense')
+        record['amount'] = amount = np.nan if default is None else default
+
+    if amount > 0:
+        record['category'] = 'Income'
+    elif _is_missing(record.get('category')):
+        category = merchant_categorizer.categorize([record['merchant']])[0] if not _is_missing(record.get('merchant')) else None
+        record['category'] = category or statistics.get('most_common_category') or 'Miscellaneous'
+
+    if VALID_CITIES.get(record.get('city')) != record.get('region'):
+        return None
+
+    record['day_of_week'] = date.weekday()
+    record['week_of_month'] = (date.day - 1) // 7 + 1
+    record['month'] = date.month
+    record['year'] = date.year
+    return record
@@ -0,0 +1,142 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stage timings of the current request, only set when the client asked for a trace
+_trace = contextvars.ContextVar('stage_trace', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", le)])} {cumulative}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram('stage_duration_seconds', 'Time spent in each processing stage.', ['stage'])
+REQUEST_SECONDS = registry.histogram('http_request_duration_seconds', 'HTTP request latency until the response starts.', ['method', 'path'])
+REQUESTS_TOTAL = registry.counter('http_requests_total', 'HTTP requests by route and status code.', ['method', 'path', 'status'])
+LLM_FIRST_TOKEN_SECONDS = registry.histogram('llm_time_to_first_token_seconds', 'Time from request to first streamed token.', ['version'])
+NARRATIVE_CACHE_LOOKUPS = registry.counter('narrative_cache_lookups_total', 'Narrative cache lookups by outcome.', ['outcome'])
+
+
+def record_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage):
+    # Usable as `with timed("stage"):` or as a `@timed("stage")` decorator
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def start_trace():
+    return _trace.set([])
+
+
+def finish_trace(token):
+    # The same list keeps collecting stages that finish later in a streamed response body
+    trace = _trace.get()
+    _trace.reset(token)
+    return trace if trace is not None else []
+
+
+def format_trace(trace):
+    # Stages in the order they finished, repeated stages summed: "stage=ms;stage=ms"
+    totals = {}
+    for stage, seconds in trace:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ';'.join(f'{stage}={seconds * 1000:.2f}' for stage, seconds in totals.items())
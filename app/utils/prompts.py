@@ -1,6 +1,95 @@
 import json
 
-def generate_financial_analysis_prompt_zero_shot(data):
+# Part of every narrative cache key. Template edits already change the key through the rendered
+# prompt; bump this only to discard every cached narrative on purpose
+PROMPT_TEMPLATE_VERSION = 1
+
+# Rough characters-per-token ratio used to estimate prompt size without a tokenizer
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def _compact_value(value):
+    if isinstance(value, float):
+        return round(value, 2)
+    return value
+
+def _transaction_table(transactions, columns):
+    rows = ["|".join(columns)]
+    for transaction in transactions:
+        rows.append("|".join("" if transaction.get(column) is None else str(_compact_value(transaction[column])).replace("|", "/") for column in columns))
+    return rows
+
+def _transaction_summary(transactions):
+    amounts = [transaction["amount"] for transaction in transactions if transaction.get("amount") is not None]
+    dates = sorted(str(transaction["date"]) for transaction in transactions if transaction.get("date"))
+    by_category = {}
+    for transaction in transactions:
+        if transaction.get("amount") is not None:
+            category = transaction.get("category") or "Unknown"
+            by_category[category] = round(by_category.get(category, 0) + transaction["amount"], 2)
+    return {
+        "count": len(transactions),
+        "first_date": dates[0] if dates else None,
+        "last_date": dates[-1] if dates else None,
+        "total_spent": round(sum(amount for amount in amounts if amount < 0), 2),
+        "total_earned": round(sum(amount for amount in amounts if amount > 0), 2),
+        "by_category": by_category
+    }
+
+def _sample_size(token_budget, fixed_tokens, item_tokens, count):
+    # How many evenly spaced items fit in the budget left after the fixed part, at least one
+    return max(1, min(int((token_budget - fixed_tokens - 20) // max(1, item_tokens)), count))
+
+def _even_sample(items, size):
+    step = len(items) / size
+    return [items[int(index * step)] for index in range(size)]
+
+def _format_json_prompt_data(data, token_budget):
+    text = json.dumps(data, indent=4)
+    transactions = data.get("transactions", [])
+    if token_budget is None or estimate_tokens(text) <= token_budget or len(transactions) <= 1:
+        return text
+
+    # Over budget: the same summary and even sample as the compact encoding, kept as JSON
+    summarized = {
+        "transaction_summary": _transaction_summary(transactions),
+        "transactions_sampled": None,
+        **data,
+        "transactions": []
+    }
+    item_tokens = estimate_tokens(json.dumps({"transactions": transactions}, indent=4)) / len(transactions)
+    sample_size = _sample_size(token_budget, estimate_tokens(json.dumps(summarized, indent=4)), item_tokens, len(transactions))
+    summarized["transactions_sampled"] = f"{sample_size} of {len(transactions)} sampled evenly"
+    summarized["transactions"] = _even_sample(transactions, sample_size)
+    return json.dumps(summarized, indent=4)
+
+def format_prompt_data(data, compact=False, token_budget=None):
+    if not compact:
+        return _format_json_prompt_data(data, token_budget)
+
+    transactions = data.get("transactions", [])
+    analysis = {key: _compact_value(value) for key, value in data.get("analysis", {}).items() if value is not None}
+    columns = [column for column in (transactions[0].keys() if transactions else []) if any(transaction.get(column) is not None for transaction in transactions)]
+    rows = _transaction_table(transactions, columns)
+    analysis_text = json.dumps(analysis, separators=(',', ':'))
+
+    header = "Transactions (pipe-separated, first row is the header):"
+    text = "\n".join([header, *rows, "Analysis:", analysis_text])
+    if token_budget is None or estimate_tokens(text) <= token_budget or len(rows) <= 2:
+        return text
+
+    # Over budget: summarize every transaction and keep an evenly spaced sample that fits
+    summary_text = json.dumps(_transaction_summary(transactions), separators=(',', ':'))
+    fixed = "\n".join([summary_text, rows[0], "Analysis:", analysis_text])
+    average_row_tokens = estimate_tokens("\n".join(rows[1:])) / (len(rows) - 1)
+    sample_size = _sample_size(token_budget, estimate_tokens(fixed), average_row_tokens, len(transactions))
+    sampled_rows = _even_sample(rows[1:], sample_size)
+    header = f"Transactions (pipe-separated, first row is the header; {sample_size} of {len(transactions)} sampled evenly):"
+    return "\n".join(["Summary of all transactions:", summary_text, header, rows[0], *sampled_rows, "Analysis:", analysis_text])
+
+def generate_financial_analysis_prompt_zero_shot(data, compact=False, token_budget=None):
     prompt = f"""
     Using the financial transactions and analysis till that transaction, provided in the JSON data below, write a comprehensive narrative that highlights changes in spending behavior with respect to earning changes over the course of a month.
 
@@ -9,11 +98,11 @@ def generate_financial_analysis_prompt_zero_shot(data):
     Ensure each observation is supported by data from the JSON and provide a clear, coherent narrative.
 
     Here is the data:
-    {json.dumps(data, indent=4)}
+    {format_prompt_data(data, compact, token_budget)}
     """
     return prompt
 
-def generate_financial_analysis_prompt_few_shot(data):
+def generate_financial_analysis_prompt_few_shot(data, compact=False, token_budget=None):
     prompt = f"""
     Below are examples of financial analysis narratives based on user transactions and analysis data. Use these examples to write a narrative for the given JSON data.
 
@@ -24,11 +113,11 @@ def generate_financial_analysis_prompt_few_shot(data):
     "In February 2023, the user's spending behavior indicated a spike in grocery and household item purchases mid-month. There was a gradual decrease in non-essential purchases towards the end of the month. Food delivery service usage was higher during lunch and dinner times on weekdays."
 
     Now, write a similar narrative based on the following data:
-    {json.dumps(data, indent=4)}
+    {format_prompt_data(data, compact, token_budget)}
     """
     return prompt
 
-def generate_financial_analysis_prompt_cot(data):
+def generate_financial_analysis_prompt_cot(data, compact=False, token_budget=None):
     prompt = f"""
     Using the financial transactions and analysis provided, generate a narrative by following a chain of thought process. Break down the analysis into logical steps to explain changes in spending behavior with respect to earning changes over the month.
 
@@ -45,6 +134,6 @@ def generate_financial_analysis_prompt_cot(data):
     "Comparing the current month's data with the previous months, there is an increase in discretionary spending on weekends, which highlights a change in leisure activities."
 
     Now, using this chain of thought, write a detailed narrative based on the following data:
-    {json.dumps(data, indent=4)}
+    {format_prompt_data(data, compact, token_budget)}
     """
     return prompt
@@ -0,0 +1,108 @@
+# Mergeable quantile sketch of transaction amounts (DDSketch-style log buckets).
+#
+# An amount a > 0 goes into bucket ceil(log(a) / log(gamma)) with gamma = (1 + alpha) / (1 - alpha).
+# A bucket is reported as 2 * gamma**i / (gamma + 1), which is within a relative error of alpha of
+# every amount in it. So any quantile read from the sketch is within alpha * |q| of the exact
+# quantile q of all amounts added. Sketches merge by adding bucket counts, which lets them be kept
+# in MongoDB with $inc. Spending and earnings are sketched separately by magnitude. Amounts below
+# MIN_AMOUNT share the lowest bucket. With alpha = 0.01, amounts from 0.01 to 10M need about 1,050
+# buckets per sketch.
+
+import numpy as np
+import pandas as pd
+from app.utils.metrics import timed
+
+SPEND = 'spend'
+EARN = 'earn'
+MIN_AMOUNT = 0.01
+OVERALL_SCOPE = None
+
+
+def gamma_for(alpha):
+    return (1 + alpha) / (1 - alpha)
+
+
+def bucket_indices(magnitudes, alpha):
+    return np.ceil(np.log(np.maximum(magnitudes, MIN_AMOUNT)) / np.log(gamma_for(alpha))).astype(np.int64)
+
+
+def bucket_values(indices, alpha):
+    gamma = gamma_for(alpha)
+    return 2 * np.power(gamma, indices) / (gamma + 1)
+
+
+def sides(amounts):
+    # Zero amounts are neither spending nor earnings, as in the aggregates
+    return np.where(amounts < 0, SPEND, np.where(amounts > 0, EARN, None))
+
+
+@timed("sketch.bucket_counts")
+def bucket_counts(df, alpha, amount_column='amount', category_column='category'):
+    # {(category or None for overall, side): {bucket: count}} for the given transactions
+    amounts = df[amount_column].to_numpy(dtype=float)
+    frame = pd.DataFrame({
+        'category': df[category_column].astype(object).to_numpy(),
+        'side': sides(amounts),
+        'bucket': bucket_indices(np.abs(amounts), alpha)
+    })
+    frame = frame[frame['side'].notna() & ~np.isnan(amounts)]
+
+    counts = {}
+    for (side, bucket), count in frame.groupby(['side', 'bucket']).size().items():
+        counts.setdefault((OVERALL_SCOPE, side), {})[int(bucket)] = int(count)
+    for (category, side, bucket), count in frame[frame['category'].notna()].groupby(['category', 'side', 'bucket']).size().items():
+        counts.setdefault((category, side), {})[int(bucket)] = int(count)
+    return counts
+
+
+def quantiles(buckets, qs, alpha):
+    # Lower quantiles (rank q * (n - 1)) of a {bucket: count} sketch
+    indices = np.array(sorted(buckets), dtype=np.int64)
+    cumulative = np.cumsum([buckets[index] for index in indices])
+    ranks = np.asarray(qs) * (cumulative[-1] - 1)
+    return bucket_values(indices[np.searchsorted(cumulative, ranks, side='right')], alpha)
+
+
+def amount_thresholds(buckets, alpha):
+    # 75th percentile as the high-value threshold, Tukey fences (1.5 IQR) as outlier bounds
+    q1, q3 = quantiles(buckets, [0.25, 0.75], alpha)
+    iqr = q3 - q1
+    return {'high': float(q3), 'lower': float(max(q1 - 1.5 * iqr, 0.0)), 'upper': float(q3 + 1.5 * iqr)}
+
+
+def flag_amount(amount, category, thresholds):
+    # Single-transaction form of flag_transactions
+    side = SPEND if amount < 0 else EARN if amount > 0 else None
+    limits = thresholds.get((category, side)) or thresholds.get((OVERALL_SCOPE, side))
+    if limits is None:
+        return {'is_high_value': False, 'is_outlier': False}
+    magnitude = abs(amount)
+    return {
+        'is_high_value': bool(magnitude > limits['high']),
+        'is_outlier': bool(magnitude < limits['lower'] or magnitude > limits['upper'])
+    }
+
+
+@timed("sketch.flag_transactions")
+def flag_transactions(df, thresholds, amount_column='amount', category_column='category'):
+    # Per-category thresholds where the category has enough history, overall ones otherwise
+    amounts = df[amount_column].to_numpy(dtype=float)
+    frame = pd.DataFrame({'category': df[category_column].astype(object).to_numpy(), 'side': sides(amounts)})
+    limits = pd.DataFrame(
+        [{'category': category, 'side': side, **values} for (category, side), values in thresholds.items()],
+        columns=['category', 'side', 'high', 'lower', 'upper']
+    )
+    by_category = limits[limits['category'].notna()]
+    overall = limits[limits['category'].isna()].drop(columns='category')
+    frame = frame.merge(by_category, on=['category', 'side'], how='left')
+    frame = frame.fillna(frame[['side']].merge(overall, on='side', how='left')[['high', 'lower', 'upper']])
+
+    magnitudes = np.abs(amounts)
+    high = frame['high'].to_numpy(dtype=float)
+    lower = frame['lower'].to_numpy(dtype=float)
+    upper = frame['upper'].to_numpy(dtype=float)
+    # Comparisons against NaN (no threshold for the row) are False
+    return pd.DataFrame({
+        'is_high_value': magnitudes > high,
+        'is_outlier': (magnitudes < lower) | (magnitudes > upper)
+    }, index=df.index)
@@ -0,0 +1,21 @@
+import orjson
+from bson import ObjectId
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if hasattr(value, 'item'):
+        # numpy scalars orjson does not handle natively, e.g. float16
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_line(data):
+    # One NDJSON line; numpy scalars/arrays are encoded natively and NaN becomes null
+    return orjson.dumps(data, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
+
+
+def dumps(data):
+    # JSON body for large responses, bypassing FastAPI's per-value encoder
+    return orjson.dumps(data, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
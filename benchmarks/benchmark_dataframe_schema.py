@@ -0,0 +1,76 @@
+# Memory per row and boolean-filter speed of the untyped versus the compact transactions DataFrame.
+# Run from the repository root: python -m benchmarks.benchmark_dataframe_schema [--rows 100000 1000000]
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from app.schemas.frames import TRANSACTION_FIELDS, apply_transaction_dtypes
+from app.utils.data_processing import VALID_CITIES
+
+
+def make_documents(rows, seed=42):
+    # Shaped like the documents pymongo returns from db.transactions
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 1460, rows), unit='D')
+    cities = rng.choice(list(VALID_CITIES), rows)
+    frame = pd.DataFrame({
+        'transaction_id': [f'T{index:08d}' for index in range(rows)],
+        'date': dates,
+        'amount': np.round(rng.normal(-25, 120, rows), 2),
+        'merchant': rng.choice([f'Merchant {index}' for index in range(200)], rows),
+        'category': rng.choice(['Groceries', 'Dining', 'Utilities', 'Income', 'Shopping', 'Travel'], rows),
+        'city': cities,
+        'region': [VALID_CITIES[city] for city in cities],
+        'payment_method': rng.choice(['Credit Card', 'Debit Card', 'Bank Transfer'], rows),
+        'day_of_week': dates.dayofweek,
+        'week_of_month': (dates.day - 1) // 7 + 1,
+        'month': dates.month,
+        'year': dates.year,
+        'uuid': rng.choice([f'upload-{index}' for index in range(50)], rows),
+    })
+    documents = frame.to_dict('records')
+    for document in documents:
+        document['_id'] = ObjectId()
+    return documents
+
+
+def untyped_frame(documents):
+    return pd.DataFrame(list(documents))
+
+
+def typed_frame(documents):
+    # The projected cursor never sends _id, excluding it here stands in for that
+    return apply_transaction_dtypes(pd.DataFrame.from_records(documents, exclude=['_id'], columns=TRANSACTION_FIELDS + ['_id']))
+
+
+def filter_seconds(df, repeat):
+    start = time.perf_counter()
+    for index in range(repeat):
+        year, month, week_of_month = 2021 + index % 3, 1 + index % 12, 1 + index % 5
+        current_week = df[(df['year'] == year) & (df['month'] == month) & (df['week_of_month'] == week_of_month)]
+        current_week[current_week['amount'] < 0]['amount'].sum()
+        df[df['category'] == 'Groceries']['amount'].sum()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10}{'frame':>9}{'bytes/row':>11}{'load s':>9}{'filter ms':>11}")
+    for rows in args.rows:
+        documents = make_documents(rows)
+        for name, loader in (('untyped', untyped_frame), ('typed', typed_frame)):
+            start = time.perf_counter()
+            df = loader(documents)
+            load_seconds = time.perf_counter() - start
+            bytes_per_row = df.memory_usage(deep=True).sum() / rows
+            print(f"{rows:>10}{name:>9}{bytes_per_row:>11,.0f}{load_seconds:>9.2f}{filter_seconds(df, args.repeat) * 1000:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Rows/sec of the row-wise (before) and vectorized (after) preprocessing steps.
+# Run from the repository root: python -m benchmarks.benchmark_preprocessing [--sizes 10000 100000 1000000]
+
+import argparse
+import contextlib
+import io
+import time
+import numpy as np
+import pandas as pd
+from app.utils.data_processing import VALID_CITIES, fill_missing_categories, validate_geographic_data, create_derived_features
+
+
+def legacy_fill_missing_categories(df, amount_column='amount', category_column='category'):
+    most_common_category = df[category_column].mode()[0] if not df[category_column].mode().empty else 'Miscellaneous'
+    df[category_column] = df.apply(
+        lambda row: 'Income' if row[amount_column] > 0 else (most_common_category if pd.isnull(row[category_column]) else row[category_column]),
+        axis=1
+    )
+    return df
+
+
+def legacy_validate_geographic_data(df, city_column='city', region_column='region'):
+    return df[df.apply(lambda row: VALID_CITIES.get(row[city_column]) == row[region_column], axis=1)]
+
+
+def legacy_create_derived_features(df, date_column='date'):
+    df['day_of_week'] = df[date_column].dt.dayofweek
+    df['week_of_month'] = df[date_column].apply(lambda x: (x.day - 1) // 7 + 1)
+    df['month'] = df[date_column].dt.month
+    df['year'] = df[date_column].dt.year
+    return df
+
+
+STEPS = [
+    ('fill_missing_categories', legacy_fill_missing_categories, fill_missing_categories),
+    ('validate_geographic_data', legacy_validate_geographic_data, validate_geographic_data),
+    ('create_derived_features', legacy_create_derived_features, create_derived_features),
+]
+
+
+def make_frame(rows, seed=42):
+    rng = np.random.default_rng(seed)
+    city = pd.Series(rng.choice(list(VALID_CITIES), rows))
+    region = city.map(VALID_CITIES).mask(rng.random(rows) < 0.05, 'ZZ')
+    category = rng.choice(np.array(['Dining', 'Groceries', 'Utilities', None], dtype=object), rows)
+    return pd.DataFrame({
+        'date': pd.Timestamp('2022-01-01') + pd.to_timedelta(rng.integers(0, 730, rows), unit='D'),
+        'amount': np.round(rng.normal(-25, 120, rows), 2),
+        'category': category,
+        'city': city,
+        'region': region,
+    })
+
+
+def time_step(function, frame):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(frame.copy())
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--skip-legacy-above', type=int, default=1_000_000,
+                        help='Skip the row-wise version above this many rows')
+    args = parser.parse_args()
+
+    print(f"{'step':<26}{'rows':>10}{'before rows/s':>16}{'after rows/s':>16}{'speedup':>10}")
+    for rows in args.sizes:
+        frame = make_frame(rows)
+        for name, before, after in STEPS:
+            after_seconds = time_step(after, frame)
+            if rows > args.skip_legacy_above:
+                print(f"{name:<26}{rows:>10}{'-':>16}{rows / after_seconds:>16,.0f}{'-':>10}")
+                continue
+            before_seconds = time_step(before, frame)
+            print(f"{name:<26}{rows:>10}{rows / before_seconds:>16,.0f}{rows / after_seconds:>16,.0f}{before_seconds / after_seconds:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# Prompt size and build time per strategy for the JSON and compact encodings.
+# Run from the repository root: python -m benchmarks.benchmark_prompts [--transactions 50 500] [--token-budget 4000]
+
+import argparse
+import random
+import time
+from app.utils.prompts import (
+    estimate_tokens,
+    generate_financial_analysis_prompt_zero_shot,
+    generate_financial_analysis_prompt_few_shot,
+    generate_financial_analysis_prompt_cot,
+)
+
+STRATEGIES = {
+    'zero_shot': generate_financial_analysis_prompt_zero_shot,
+    'few_shot': generate_financial_analysis_prompt_few_shot,
+    'cot': generate_financial_analysis_prompt_cot,
+}
+
+ANALYSIS_FIELDS = [
+    'historical_average_spending', 'current_week_spending', 'spending_comparison',
+    'historical_average_earnings', 'current_week_earnings', 'earnings_comparison',
+    'current_month_spending', 'current_month_earnings', 'historical_month_spending',
+    'historical_month_earnings', 'overall_spending', 'overall_earnings',
+]
+
+
+def make_payload(count, seed=42):
+    rng = random.Random(seed)
+    transactions = [{
+        'transaction_id': f'T{index:06d}',
+        'date': f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+        'amount': rng.uniform(-300, 200),
+        'merchant': rng.choice(['Grocer', 'Cafe', 'Utility Co', 'Employer', 'Bookshop']),
+        'category': rng.choice(['Groceries', 'Dining', 'Utilities', 'Income', 'Shopping']),
+        'city': 'Chicago',
+        'region': 'IL',
+        'payment_method': rng.choice(['Credit Card', 'Debit Card', 'Bank Transfer']),
+        'day_of_week': None,
+        'week_of_month': None,
+        'month': None,
+        'uuid': None,
+    } for index in range(count)]
+    analysis = {field: rng.uniform(-5000, 5000) for field in ANALYSIS_FIELDS}
+    return {'transactions': transactions, 'analysis': analysis}
+
+
+def build(builder, payload, compact, token_budget, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        prompt = builder(payload, compact, token_budget)
+    return prompt, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--transactions', type=int, nargs='+', default=[50, 500, 5000])
+    parser.add_argument('--token-budget', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'strategy':<10}{'txns':>7}{'mode':>9}{'chars':>11}{'~tokens':>10}{'build ms':>10}")
+    for count in args.transactions:
+        payload = make_payload(count)
+        for name, builder in STRATEGIES.items():
+            for mode, compact, budget in (('json', False, None), ('compact', True, args.token_budget)):
+                prompt, seconds = build(builder, payload, compact, budget, args.repeat)
+                print(f"{name:<10}{count:>7}{mode:>9}{len(prompt):>11,}{estimate_tokens(prompt):>10,}{seconds * 1000:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
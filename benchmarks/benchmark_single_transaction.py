@@ -0,0 +1,48 @@
+# Per-record CPU cost of the DataFrame pipeline versus the plain-dict fast path.
+# Run from the repository root: python -m benchmarks.benchmark_single_transaction [--iterations 2000]
+
+import argparse
+import contextlib
+import io
+import time
+import pandas as pd
+from app.utils.data_processing import preprocess_single_transaction, preprocess_transaction_record
+
+TRANSACTION = {
+    'transaction_id': 'bench-1',
+    'date': '2024-03-09',
+    'amount': -42.5,
+    'merchant': 'Grocer',
+    'category': 'Groceries',
+    'city': 'Chicago',
+    'region': 'IL',
+    'payment_method': 'Credit Card',
+    'day_of_week': None,
+    'week_of_month': None,
+    'month': None,
+    'uuid': None,
+}
+
+
+def time_per_call(function, iterations):
+    start = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(iterations):
+            function()
+    return (time.process_time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    dataframe_seconds = time_per_call(lambda: preprocess_single_transaction(pd.DataFrame([TRANSACTION])), args.iterations)
+    record_seconds = time_per_call(lambda: preprocess_transaction_record(TRANSACTION), args.iterations)
+    print(f"DataFrame pipeline: {dataframe_seconds * 1e6:,.1f} us/record")
+    print(f"Record fast path:   {record_seconds * 1e6:,.1f} us/record")
+    print(f"Speedup:            {dataframe_seconds / record_seconds:,.0f}x")
+
+
+if __name__ == '__main__':
+    main()
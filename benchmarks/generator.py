@@ -0,0 +1,91 @@
+# Seeded synthetic transactions shaped like the Transaction schema and the CSV uploads.
+
+import numpy as np
+import pandas as pd
+from app.utils.data_processing import VALID_CITIES
+
+MERCHANTS = {
+    'Groceries': ['Whole Foods', 'Trader Joes', 'Kroger', 'Safeway'],
+    'Dining': ['Starbucks', 'Chipotle', 'Olive Garden', 'Local Diner'],
+    'Utilities': ['Electric Co', 'Water Dept', 'Gas Utility', 'Internet Provider'],
+    'Shopping': ['Amazon', 'Target', 'Walmart', 'Best Buy'],
+    'Travel': ['Delta', 'Uber', 'Marriott', 'Shell'],
+    'Income': ['Employer Payroll', 'Freelance Client', 'Online Sales', 'Interest'],
+}
+# Raw category labels as they appear in bank exports, including the variants correct_category_names maps
+RAW_CATEGORIES = {
+    'Groceries': ['Groceries', 'Grocery Store'],
+    'Dining': ['Dining', 'Dining Out'],
+    'Utilities': ['Utilities', 'Electric Bill'],
+    'Shopping': ['Shopping'],
+    'Travel': ['Travel'],
+    'Income': ['Income', 'Freelance', 'Sales'],
+}
+PAYMENT_METHODS = ['Credit Card', 'Debit Card', 'Bank Transfer', 'Cash']
+
+
+def generate_transactions(rows, seed=42, start='2022-01-01', days=730, missing_rate=0.02, invalid_region_rate=0.02):
+    rng = np.random.default_rng(seed)
+    kinds = np.array(list(MERCHANTS))
+    # Roughly one in six transactions is income
+    kind_index = rng.choice(len(kinds), rows, p=[0.25, 0.2, 0.1, 0.2, 0.08, 0.17])
+    kind = kinds[kind_index]
+    is_income = kind == 'Income'
+
+    merchant = np.empty(rows, dtype=object)
+    category = np.empty(rows, dtype=object)
+    for name in kinds:
+        mask = kind == name
+        count = int(mask.sum())
+        merchant[mask] = rng.choice(MERCHANTS[name], count)
+        category[mask] = rng.choice(RAW_CATEGORIES[name], count)
+
+    amount = np.where(
+        is_income,
+        np.round(rng.lognormal(6.5, 0.8, rows), 2),
+        -np.round(rng.lognormal(3.5, 1.0, rows), 2)
+    )
+    amount = np.where(rng.random(rows) < missing_rate, np.nan, amount)
+    category = np.where(rng.random(rows) < missing_rate, None, category)
+
+    cities = np.array(list(VALID_CITIES))
+    city = cities[rng.integers(0, len(cities), rows)]
+    region = pd.Series(city).map(VALID_CITIES).to_numpy(dtype=object)
+    region = np.where(rng.random(rows) < invalid_region_rate, 'ZZ', region)
+
+    dates = np.datetime64(start, 'D') + rng.integers(0, days, rows).astype('timedelta64[D]')
+
+    return pd.DataFrame({
+        'transaction_id': 'T' + pd.Series(np.arange(rows)).astype(str),
+        'date': np.datetime_as_string(dates, unit='D').astype(object),
+        'amount': amount,
+        'merchant': merchant,
+        'category': category,
+        'city': city.astype(object),
+        'region': region,
+        'payment_method': rng.choice(PAYMENT_METHODS, rows).astype(object),
+    })
+
+
+def generate_transaction_records(count, seed=42):
+    # Transaction-model dicts, as sent to /upload_single_transaction/ and in narrative payloads
+    frame = generate_transactions(count, seed=seed, missing_rate=0, invalid_region_rate=0)
+    records = frame.to_dict('records')
+    for record in records:
+        record.update({'day_of_week': None, 'week_of_month': None, 'month': None, 'uuid': None})
+    return records
+
+
+def generate_analyses(count, seed=42):
+    rng = np.random.default_rng(seed)
+    fields = [
+        'historical_average_spending', 'current_week_spending', 'spending_comparison',
+        'historical_average_earnings', 'current_week_earnings', 'earnings_comparison',
+        'current_month_spending', 'current_month_earnings', 'historical_month_spending',
+        'historical_month_earnings', 'overall_spending', 'overall_earnings',
+    ]
+    values = np.round(rng.normal(0, 2000, (count, len(fields))), 2)
+    return [
+        {'_id': f'{index:024x}', 'transaction_id': f'T{index}', **dict(zip(fields, row.tolist()))}
+        for index, row in enumerate(values)
+    ]
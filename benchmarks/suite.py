@@ -0,0 +1,256 @@
+# Reproducible benchmark suite. Writes results as JSON and fails on regressions against a baseline.
+#
+# Run from the repository root:
+#   python -m benchmarks.suite --sizes 1000 100000 --output bench.json
+#   python -m benchmarks.suite --sizes 1000 100000 --baseline bench.json --threshold 0.2
+#   python -m benchmarks.suite --e2e --mongo-uri mongodb://localhost:27017 --sizes 1000 10000
+#
+# The end-to-end cases go through the FastAPI test client. They need a running mongod and use a
+# throwaway database that is dropped afterwards.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generator import generate_transactions, generate_transaction_records, generate_analyses
+
+ANALYZER_FUNCTIONS = [
+    'get_historical_average_spending',
+    'get_current_week_spending',
+    'get_historical_average_earnings',
+    'get_current_week_earnings',
+    'get_monthly_totals',
+    'get_historical_monthly_totals',
+]
+
+
+def best_of(function, repeat):
+    # Minimum wall time over `repeat` runs; the least noisy estimate of the cost
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def result(seconds, rows=None, calls=None):
+    entry = {'seconds': seconds}
+    if rows:
+        entry['rows'] = rows
+        entry['rows_per_second'] = rows / seconds if seconds else None
+    if calls:
+        entry['calls'] = calls
+        entry['seconds_per_call'] = seconds / calls
+    return entry
+
+
+def bench_preprocessing(sizes, seed, repeat):
+    from app.utils.data_processing import preprocess_data
+
+    results = {}
+    for rows in sizes:
+        raw = generate_transactions(rows, seed=seed)
+        results[f'preprocess_data[{rows}]'] = result(best_of(lambda: preprocess_data(raw.copy()), repeat), rows=rows)
+    return results
+
+
+def bench_analyzer(sizes, seed, repeat, calls=200):
+    from app.utils.data_processing import preprocess_data
+    from app.services import financial_analyzer
+    from app.services.aggregate_service import aggregate_weekly, MONTH_KEYS, TOTAL_FIELDS
+
+    results = {}
+    rng = np.random.default_rng(seed)
+    for rows in sizes:
+        transactions = preprocess_data(generate_transactions(rows, seed=seed))
+        results[f'aggregate_weekly[{rows}]'] = result(best_of(lambda: aggregate_weekly(transactions), repeat), rows=rows)
+
+        weekly = aggregate_weekly(transactions)
+        monthly = weekly.groupby(MONTH_KEYS, as_index=False)[TOTAL_FIELDS].sum()
+        overall = {field: weekly[field].sum() for field in TOTAL_FIELDS}
+        keys = transactions[['year', 'month', 'week_of_month']].iloc[rng.integers(0, len(transactions), calls)].to_numpy()
+
+        for name in ANALYZER_FUNCTIONS:
+            function = getattr(financial_analyzer, name)
+            source = monthly if 'monthly' in name else weekly
+
+            def run_calls():
+                for year, month, week_of_month in keys:
+                    if 'monthly' in name:
+                        function(source, year, month)
+                    else:
+                        function(source, year, month, week_of_month)
+
+            results[f'{name}[{rows}]'] = result(best_of(run_calls, repeat), calls=calls)
+
+        results[f'get_overall_totals[{rows}]'] = result(
+            best_of(lambda: [financial_analyzer.get_overall_totals(overall) for _ in range(calls)], repeat), calls=calls
+        )
+        results[f'analyze_transactions_batch[{rows}]'] = result(
+            best_of(lambda: financial_analyzer.analyze_transactions_batch(transactions, weekly, monthly, overall), repeat), rows=rows
+        )
+    return results
+
+
+def bench_comparisons(seed, repeat, counts=(3, 1000)):
+    from app.services.financial_analyzer import compare_last_three_analyses
+
+    results = {}
+    for count in counts:
+        analyses = generate_analyses(count, seed=seed)
+        results[f'compare_last_three_analyses[{count}]'] = result(best_of(lambda: compare_last_three_analyses(analyses), repeat), rows=count)
+    return results
+
+
+def bench_prompts(seed, repeat, counts=(50, 500)):
+    from app.utils import prompts
+
+    builders = {
+        'zero_shot': prompts.generate_financial_analysis_prompt_zero_shot,
+        'few_shot': prompts.generate_financial_analysis_prompt_few_shot,
+        'cot': prompts.generate_financial_analysis_prompt_cot,
+    }
+    results = {}
+    for count in counts:
+        payload = {'transactions': generate_transaction_records(count, seed=seed), 'analysis': generate_analyses(1, seed=seed)[0]}
+        payload['analysis'].pop('_id')
+        payload['analysis'].pop('transaction_id')
+        for name, builder in builders.items():
+            for mode, compact in (('json', False), ('compact', True)):
+                entry = result(best_of(lambda: builder(payload, compact), repeat), rows=count)
+                entry['prompt_chars'] = len(builder(payload, compact))
+                results[f'prompt_{name}_{mode}[{count}]'] = entry
+    return results
+
+
+def bench_end_to_end(sizes, seed, repeat, mongo_uri, single_calls=100):
+    # Configure the app for a throwaway database before it is imported
+    database_name = f'financial_analyzer_bench_{os.getpid()}'
+    os.environ['MONGO_URI'] = mongo_uri
+    os.environ['DATABASE_NAME'] = database_name
+    os.environ['USE_TEST_DB'] = 'false'
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.database.mongo import client
+
+    results = {}
+    try:
+        with TestClient(app) as test_client:
+            # Seed enough history that uploads take the analysis path
+            seed_csv = generate_transactions(1000, seed=seed + 1).to_csv(index=False)
+            test_client.post('/upload_transactions/', files={'file': ('seed.csv', seed_csv)}).raise_for_status()
+
+            for rows in sizes:
+                # Uploads are idempotent, so every timed run gets transaction_ids the database has not seen
+                files = iter([
+                    generate_transactions(rows, seed=seed).assign(transaction_id=lambda df, run=run: f'{rows}-{run}-' + df['transaction_id']).to_csv(index=False)
+                    for run in range(repeat)
+                ])
+                last = {}
+
+                def upload():
+                    last['csv'] = next(files)
+                    test_client.post('/upload_transactions/', files={'file': ('bench.csv', last['csv'])}).raise_for_status()
+
+                def reupload():
+                    test_client.post('/upload_transactions/', files={'file': ('bench.csv', last['csv'])}).raise_for_status()
+
+                results[f'upload_transactions[{rows}]'] = result(best_of(upload, repeat), rows=rows)
+                results[f'reupload_transactions[{rows}]'] = result(best_of(reupload, repeat), rows=rows)
+
+            records = iter(
+                {**record, 'transaction_id': f"single-{record['transaction_id']}"}
+                for record in generate_transaction_records(single_calls * repeat, seed=seed)
+            )
+
+            def upload_singles():
+                for _ in range(single_calls):
+                    test_client.post('/upload_single_transaction/', json=next(records)).raise_for_status()
+
+            results['upload_single_transaction'] = result(best_of(upload_singles, repeat), calls=single_calls)
+    finally:
+        client.drop_database(database_name)
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold):
+    regressions = []
+    for name, entry in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous.get('seconds'):
+            continue
+        ratio = entry['seconds'] / previous['seconds']
+        entry['baseline_seconds'] = previous['seconds']
+        entry['change'] = ratio - 1
+        if ratio > 1 + threshold:
+            regressions.append((name, previous['seconds'], entry['seconds'], ratio - 1))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Financial analyzer benchmark suite')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 100_000], help='Row counts (1k up to 10M)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the fastest is recorded')
+    parser.add_argument('--output', help='Write results JSON to this path')
+    parser.add_argument('--baseline', help='Results JSON from an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown before failing, 0.2 = 20%%')
+    parser.add_argument('--e2e', action='store_true', help='Include end-to-end upload benchmarks (needs mongod)')
+    parser.add_argument('--e2e-sizes', type=int, nargs='+', default=None, help='Row counts for end-to-end uploads (defaults to --sizes)')
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    args = parser.parse_args(argv)
+
+    results = {}
+    results.update(bench_preprocessing(args.sizes, args.seed, args.repeat))
+    results.update(bench_analyzer(args.sizes, args.seed, args.repeat))
+    results.update(bench_comparisons(args.seed, args.repeat))
+    results.update(bench_prompts(args.seed, args.repeat))
+    if args.e2e:
+        results.update(bench_end_to_end(args.e2e_sizes or args.sizes, args.seed, args.repeat, args.mongo_uri))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.threshold)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'sizes': args.sizes,
+        },
+        'results': results,
+    }
+
+    for name, entry in results.items():
+        change = f" ({entry['change']:+.1%})" if 'change' in entry else ''
+        print(f"{name:<48}{entry['seconds'] * 1000:>12.2f} ms{change}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}:")
+        for name, before, after, change in regressions:
+            print(f"  {name}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms ({change:+.1%})")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+import os
+import pytest
+from dotenv import load_dotenv
+
+# Point the app at a throwaway database before any test imports it
+load_dotenv()
+os.environ['MONGO_URI'] = os.getenv('MONGO_TEST_URI') or 'mongodb://localhost:27017'
+os.environ['USE_TEST_DB'] = 'true'
+os.environ.setdefault('TEST_DATABASE_NAME', 'financial_analyzer_test')
+
+
+@pytest.fixture(scope='session')
+def mongod_available():
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+
+    probe = MongoClient(os.environ['MONGO_URI'], serverSelectionTimeoutMS=1000)
+    try:
+        probe.admin.command('ping')
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        probe.close()
+
+
+@pytest.fixture
+def mongo_db(mongod_available):
+    if not mongod_available:
+        pytest.skip(f"no mongod reachable at {os.environ['MONGO_URI']}")
+    from app.database.mongo import client, db
+    from app.database.indexes import ensure_indexes
+
+    client.drop_database(db.name)
+    ensure_indexes()
+    yield db
+    client.drop_database(db.name)
+
+
+@pytest.fixture
+def store_transactions(mongo_db):
+    # Saves `rows` generated transactions under one upload; ids are prefixed so stores never collide
+    from benchmarks.generator import generate_transactions
+    from app.utils.data_processing import preprocess_data
+    from app.services.transaction_service import save_transaction
+
+    def store(rows, seed, prefix):
+        raw = generate_transactions(rows, seed=seed)
+        raw['transaction_id'] = prefix + raw['transaction_id']
+        return save_transaction(preprocess_data(raw), f'{prefix}-upload')
+    return store
@@ -0,0 +1,65 @@
+# Local OpenAI-compatible chat completions server that streams scripted deltas over SSE
+import asyncio
+import json
+from aiohttp import web
+
+
+class FakeLLMServer:
+    def __init__(self, tokens=('Spending ', 'is ', 'steady.'), delay=0.05):
+        self.tokens = list(tokens)
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.prompts = []
+        self.url = None
+        self._runner = None
+
+    def _chunk(self, model, delta, finish_reason=None):
+        event = {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion.chunk',
+            'model': model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+        }
+        return f"data: {json.dumps(event)}\n\n".encode('utf-8')
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        self.prompts.append(body['messages'][0]['content'])
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        finished = False
+        try:
+            await response.write(self._chunk(body['model'], {'role': 'assistant'}))
+            for token in self.tokens:
+                await asyncio.sleep(self.delay)
+                await response.write(self._chunk(body['model'], {'content': token}))
+            await response.write(self._chunk(body['model'], {}, 'stop'))
+            await response.write(b"data: [DONE]\n\n")
+            finished = True
+        finally:
+            self.active -= 1
+            if finished:
+                self.completed += 1
+            else:
+                # The client went away before the completion finished
+                self.cancelled += 1
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.chat_completions)
+        self._runner = web.AppRunner(app, handler_cancellation=True)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}/v1"
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import socket
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+import pytest_asyncio
+import uvicorn
+
+import app.main as main
+from app.config import Config
+from app.services.narrative_cache import NarrativeCache
+from tests.fake_llm import FakeLLMServer
+
+VERSIONS = ['zero_shot', 'few_shot', 'cot']
+
+PAYLOAD = {
+    'transactions': [{
+        'transaction_id': 'T1',
+        'date': '2024-03-09',
+        'amount': -42.5,
+        'merchant': 'Kroger',
+        'category': 'Groceries',
+        'city': 'Chicago',
+        'region': 'IL',
+        'payment_method': 'Credit Card'
+    }],
+    'analysis': {
+        'historical_average_spending': -120.0,
+        'current_week_spending': -150.0,
+        'spending_comparison': -30.0,
+        'historical_average_earnings': 900.0,
+        'current_week_earnings': 850.0,
+        'earnings_comparison': -50.0,
+        'current_month_spending': -600.0,
+        'current_month_earnings': 3400.0,
+        'historical_month_spending': -550.0,
+        'historical_month_earnings': 3300.0,
+        'overall_spending': -9000.0,
+        'overall_earnings': 41000.0
+    }
+}
+
+
+@pytest.fixture(scope='module')
+def app_url():
+    # A real server, so a client disconnect reaches the app the way it does in production
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(main.app, lifespan='off', log_level='warning'))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+@pytest.fixture
+def saved_interpretations(monkeypatch):
+    # Keeps the tests off MongoDB: nothing is cached in the store, saves are only recorded
+    saved = []
+    monkeypatch.setattr(main, 'find_cached_narrative', lambda version, cache_key: None)
+    monkeypatch.setattr(main, 'save_interpretation', lambda *args: saved.append(args))
+    monkeypatch.setattr(main, 'narrative_cache', NarrativeCache(max_size=128, ttl=3600))
+    monkeypatch.setattr(Config, 'OPENAI_API_KEY', 'test-key')
+    monkeypatch.setattr(Config, 'OPEN_AI_MODEL', 'fake-model')
+    return saved
+
+
+@pytest_asyncio.fixture
+async def fake_llm(monkeypatch):
+    server = await FakeLLMServer().start()
+    monkeypatch.setattr(openai, 'api_base', server.url)
+    yield server
+    await server.stop()
+
+
+def parse_event(block):
+    fields = dict(line.split(':', 1) for line in block.split('\n') if ':' in line)
+    return fields.get('event', '').strip(), fields.get('data', '').strip()
+
+
+async def read_events(response, stop_at=None):
+    # (event, data, seconds since the request) for each SSE event, optionally stopping early
+    events = []
+    buffer = ''
+    start = time.perf_counter()
+    async for text in response.aiter_text():
+        buffer += text
+        while '\n\n' in buffer:
+            block, buffer = buffer.split('\n\n', 1)
+            event, data = parse_event(block)
+            events.append((event, data, time.perf_counter() - start))
+            if stop_at is not None and stop_at(event):
+                return events
+    return events
+
+
+@pytest.mark.asyncio
+async def test_versions_stream_concurrently(app_url, fake_llm, saved_interpretations):
+    fake_llm.delay = 0.3
+    async with httpx.AsyncClient(base_url=app_url, timeout=30) as client:
+        async with client.stream('POST', '/generate-narrative/', json=PAYLOAD) as response:
+            events = await read_events(response)
+
+    names = [event for event, _, _ in events]
+    assert names[0] == 'start_narrative_stream'
+    assert names[-1] == 'end_narrative_stream'
+    assert fake_llm.max_active == 3
+
+    # Every version delivers tokens before any version finishes, i.e. the streams are multiplexed
+    first_end = min(names.index(f'end_narrative_{version}') for version in VERSIONS)
+    for version in VERSIONS:
+        assert names.index(f'narrative_{version}') < first_end
+        text = ''.join(json.loads(data)[f'narrative_{version}'] for event, data, _ in events if event == f'narrative_{version}')
+        assert text == ''.join(fake_llm.tokens)
+
+    # Close to one completion's latency rather than the sum of three
+    single = fake_llm.delay * len(fake_llm.tokens)
+    assert events[-1][2] < 2 * single
+    assert len(saved_interpretations) == 1
+
+
+@pytest.mark.asyncio
+async def test_narrative_timeout_emits_error_event(app_url, fake_llm, saved_interpretations, monkeypatch):
+    fake_llm.delay = 1.0
+    monkeypatch.setattr(Config, 'NARRATIVE_TIMEOUT', 0.3)
+    async with httpx.AsyncClient(base_url=app_url, timeout=30) as client:
+        async with client.stream('POST', '/generate-narrative/', json=PAYLOAD) as response:
+            events = await read_events(response)
+
+    errors = [json.loads(data)['error'] for event, data, _ in events if event == 'error']
+    assert sorted(errors) == sorted(f"Version {version} timed out after 0.3 seconds" for version in VERSIONS)
+    assert not any(event.startswith('end_narrative_') and event != 'end_narrative_stream' for event, _, _ in events)
+    assert events[-1][0] == 'end_narrative_stream'
+    assert events[-1][2] < fake_llm.delay
+    assert saved_interpretations == []
+
+
+@pytest.mark.asyncio
+async def test_client_disconnect_cancels_llm_calls(app_url, fake_llm, saved_interpretations):
+    fake_llm.tokens = ['token '] * 50
+    fake_llm.delay = 0.1
+    async with httpx.AsyncClient(base_url=app_url, timeout=30) as client:
+        async with client.stream('POST', '/generate-narrative/', json=PAYLOAD) as response:
+            # Leave as soon as the first token arrives
+            await read_events(response, stop_at=lambda event: event.startswith('narrative_'))
+    assert fake_llm.max_active == 3
+
+    deadline = time.monotonic() + 5
+    while fake_llm.active and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    assert fake_llm.active == 0
+    assert fake_llm.cancelled == 3
+    assert fake_llm.completed == 0
+    assert saved_interpretations == []
+
+
+@pytest.mark.asyncio
+async def test_empty_narrative_is_not_cached(app_url, fake_llm, saved_interpretations):
+    fake_llm.tokens = []
+    async with httpx.AsyncClient(base_url=app_url, timeout=30) as client:
+        for _ in range(2):
+            async with client.stream('POST', '/generate-narrative/', json=PAYLOAD) as response:
+                events = await read_events(response)
+            assert not any(event.startswith('narrative_') for event, _, _ in events)
+
+    # The second request calls the LLM again instead of replaying an empty narrative
+    assert fake_llm.completed == 6
+    assert saved_interpretations == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('compact', [True, False])
+async def test_token_budget_change_misses_the_cache(app_url, fake_llm, saved_interpretations, monkeypatch, compact):
+    transaction = PAYLOAD['transactions'][0]
+    payload = {**PAYLOAD, 'transactions': [{**transaction, 'transaction_id': f'T{index}'} for index in range(40)]}
+    monkeypatch.setattr(Config, 'PROMPT_COMPACT', compact)
+
+    async def generate():
+        async with httpx.AsyncClient(base_url=app_url, timeout=30) as client:
+            async with client.stream('POST', '/generate-narrative/', json=payload) as response:
+                await read_events(response)
+
+    await generate()
+    await generate()
+    assert fake_llm.completed == 3
+
+    # A budget that trims the prompt must not be answered with narratives built from the full one
+    monkeypatch.setattr(Config, 'PROMPT_TOKEN_BUDGET', 200)
+    await generate()
+    assert fake_llm.completed == 6
+    assert not set(fake_llm.prompts[3:]) & set(fake_llm.prompts[:3])
+    assert all('sampled evenly' in prompt for prompt in fake_llm.prompts[3:])
+
+
+@pytest.mark.asyncio
+async def test_stage_trace_logs_streamed_stages(app_url, fake_llm, saved_interpretations, caplog):
+    caplog.set_level(logging.INFO, logger='app.main')
+    async with httpx.AsyncClient(base_url=app_url, timeout=30) as client:
+        async with client.stream('POST', '/generate-narrative/', json=PAYLOAD, headers={'X-Stage-Trace': '1'}) as response:
+            # The header is sent before any LLM call finishes
+            assert 'llm.' not in response.headers['X-Stage-Breakdown']
+            await read_events(response)
+
+    deadline = time.monotonic() + 5
+    while not any('Stage breakdown' in record.message for record in caplog.records) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    [breakdown] = [record.message for record in caplog.records if 'Stage breakdown' in record.message]
+    assert all(f'llm.{version}=' in breakdown for version in VERSIONS)
@@ -0,0 +1,96 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from benchmarks.generator import generate_transactions
+from app.main import app
+from app.utils.data_processing import preprocess_data
+from app.services import query_service
+from app.services.query_service import get_spending_by_category, get_earnings_by_region, get_top_merchants
+
+
+@pytest.fixture(params=['mongod', 'mongomock'])
+def transactions(request, monkeypatch):
+    if request.param == 'mongod':
+        return request.getfixturevalue('store_transactions')(600, seed=7, prefix='q')
+    # The pipeline shapes against an in-memory server, so they are checked without mongod too
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(query_service, 'db', db)
+    df = preprocess_data(generate_transactions(600, seed=7))
+    db.transactions.insert_many(df.to_dict('records'))
+    return df
+
+
+def expected_breakdown(df, keys):
+    # {group key: (total, count)} computed in pandas from the stored rows
+    grouped = df.groupby(keys)['amount'].agg(['sum', 'count'])
+    return {(key if isinstance(key, tuple) else (key,)): (row['sum'], row['count']) for key, row in grouped.iterrows()}
+
+
+def as_breakdown(results, keys, total_name):
+    return {tuple(row[key] for key in keys): (row[total_name], row['transactions']) for row in results}
+
+
+def assert_same_breakdown(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key, (total, count) in expected.items():
+        assert actual[key][0] == pytest.approx(total)
+        assert actual[key][1] == count
+
+
+def test_spending_by_category(transactions):
+    results = get_spending_by_category()
+    spend = transactions[transactions['amount'] < 0]
+    assert_same_breakdown(
+        as_breakdown(results, ['year', 'month', 'category'], 'total_spent'),
+        expected_breakdown(spend, ['year', 'month', 'category'])
+    )
+    assert [(row['year'], row['month']) for row in results] == sorted((row['year'], row['month']) for row in results)
+
+
+def test_spending_by_category_date_range(transactions):
+    results = get_spending_by_category('2022-03-01', '2022-05-31')
+    in_range = transactions[(transactions['amount'] < 0) & transactions['date'].between('2022-03-01', '2022-05-31')]
+    assert_same_breakdown(
+        as_breakdown(results, ['year', 'month', 'category'], 'total_spent'),
+        expected_breakdown(in_range, ['year', 'month', 'category'])
+    )
+    assert {row['month'] for row in results} <= {3, 4, 5}
+
+
+def test_earnings_by_region(transactions):
+    results = get_earnings_by_region('2022-01-01', '2022-12-31')
+    earnings = transactions[(transactions['amount'] > 0) & transactions['date'].between('2022-01-01', '2022-12-31')]
+    assert_same_breakdown(
+        as_breakdown(results, ['region'], 'total_earned'),
+        expected_breakdown(earnings, ['region'])
+    )
+    totals = [row['total_earned'] for row in results]
+    assert totals == sorted(totals, reverse=True)
+
+
+def test_top_merchants(transactions):
+    results = get_top_merchants(limit=3)
+    spend = transactions[transactions['amount'] < 0]
+    expected = spend.groupby('merchant')['amount'].agg(['sum', 'count']).sort_values('sum').head(3)
+    assert [row['merchant'] for row in results] == expected.index.tolist()
+    assert [row['total_spent'] for row in results] == pytest.approx(expected['sum'].tolist())
+    assert [row['transactions'] for row in results] == expected['count'].tolist()
+
+
+def test_breakdown_endpoints(transactions):
+    client = TestClient(app)
+
+    response = client.get('/breakdowns/spending-by-category/', params={'start_date': '2022-03-01', 'end_date': '2022-05-31'})
+    assert response.status_code == 200
+    assert response.json() == {'status': 'success', 'breakdown': get_spending_by_category('2022-03-01', '2022-05-31')}
+
+    response = client.get('/breakdowns/earnings-by-region/')
+    assert response.status_code == 200
+    assert response.json() == {'status': 'success', 'breakdown': get_earnings_by_region()}
+
+    response = client.get('/breakdowns/top-merchants/', params={'limit': 2})
+    assert response.status_code == 200
+    assert response.json() == {'status': 'success', 'breakdown': get_top_merchants(limit=2)}
+
+    assert client.get('/breakdowns/top-merchants/', params={'start_date': 'not-a-date'}).status_code == 400
@@ -0,0 +1,24 @@
+import pandas as pd
+import pytest
+
+from app.services.aggregate_service import get_weekly_aggregates, get_monthly_aggregates, get_overall_aggregate, WEEK_KEYS, MONTH_KEYS
+from app.services.snapshot_service import export_transactions_snapshot, load_snapshot_aggregates
+
+
+def test_snapshot_matches_live_aggregates_after_incremental_export(store_transactions, tmp_path):
+    transactions = store_transactions(600, seed=7, prefix='q')
+    assert export_transactions_snapshot(directory=str(tmp_path)) == len(transactions)
+
+    added = store_transactions(250, seed=8, prefix='r')
+    assert export_transactions_snapshot(directory=str(tmp_path)) == len(added)
+
+    weekly, monthly, overall = load_snapshot_aggregates(directory=str(tmp_path))
+    live_weekly = get_weekly_aggregates()
+    live_monthly = get_monthly_aggregates()
+
+    def ordered(frame, keys):
+        return frame.astype({key: int for key in keys}).sort_values(keys).reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(ordered(weekly, WEEK_KEYS), ordered(live_weekly, WEEK_KEYS), check_dtype=False)
+    pd.testing.assert_frame_equal(ordered(monthly, MONTH_KEYS), ordered(live_monthly, MONTH_KEYS), check_dtype=False)
+    assert overall == pytest.approx(get_overall_aggregate())
@@ -0,0 +1,101 @@
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+from benchmarks.generator import generate_transactions
+from app.main import app
+from app.services.upload_service import MISSING_ID_MESSAGE
+from app.utils.data_processing import preprocess_csv_file
+
+
+def upload_frame(rows, seed, missing_ids=0):
+    df = generate_transactions(rows, seed=seed)
+    df['transaction_id'] = f'u{seed}-' + df['transaction_id']
+    df.loc[df.index[:missing_ids], 'transaction_id'] = None
+    return df
+
+
+def test_preprocess_csv_file_counts_rejected_and_skipped_rows(tmp_path):
+    path = tmp_path / 'upload.csv'
+    df = upload_frame(50, seed=1, missing_ids=3)
+    pd.concat([df, df.iloc[[10]]]).to_csv(path, index=False)
+
+    new, skipped_rows, rejected_rows = preprocess_csv_file(str(path), known_ids=df['transaction_id'].iloc[20:25].tolist())
+    assert rejected_rows == 3
+    assert skipped_rows == 6
+    assert new['transaction_id'].notna().all()
+
+
+def test_reuploaded_superset_imputes_new_rows_like_the_full_file(tmp_path):
+    path = tmp_path / 'superset.csv'
+    stored = upload_frame(60, seed=5)
+    new = upload_frame(20, seed=6)
+    new.loc[new.index[:4], 'amount'] = None
+    new.loc[new.index[4:8], 'category'] = None
+    pd.concat([stored, new]).to_csv(path, index=False)
+
+    full, _, _ = preprocess_csv_file(str(path))
+    deduplicated, skipped_rows, _ = preprocess_csv_file(str(path), known_ids=stored['transaction_id'].tolist())
+    assert skipped_rows == len(stored)
+
+    columns = ['transaction_id', 'amount', 'category']
+    expected = full[full['transaction_id'].isin(new['transaction_id'])][columns].reset_index(drop=True)
+    pd.testing.assert_frame_equal(deduplicated[columns].reset_index(drop=True), expected)
+
+
+def test_upload_reports_rows_without_transaction_id(mongo_db):
+    client = TestClient(app)
+    first = upload_frame(40, seed=2, missing_ids=4)
+    response = client.post('/upload_transactions/', files={'file': ('first.csv', first.to_csv(index=False))})
+    assert response.status_code == 200
+    body = response.json()
+    assert body['rejected_rows'] == 4
+    assert body['rejected_message'] == MISSING_ID_MESSAGE
+    assert body['skipped_rows'] == 0
+    assert mongo_db.transactions.count_documents({'transaction_id': None}) == 0
+
+    # Already stored rows are skipped, and they are never counted as rejected
+    second = pd.concat([first.iloc[4:14], upload_frame(10, seed=3)])
+    body = client.post('/upload_transactions/', files={'file': ('second.csv', second.to_csv(index=False))}).json()
+    assert body['skipped_rows'] == 10
+    assert body['rejected_rows'] == 0
+    assert 'rejected_message' not in body
+
+
+def test_job_upload_of_a_processed_file_points_at_its_results(mongo_db):
+    client = TestClient(app)
+    csv = upload_frame(40, seed=4).to_csv(index=False)
+    first = client.post('/upload_transactions/', files={'file': ('first.csv', csv)}).json()
+
+    response = client.post('/jobs/upload_transactions/', files={'file': ('again.csv', csv)})
+    assert response.status_code == 200
+    body = response.json()
+    assert body['status'] == 'duplicate'
+    assert body['uuid'] == first['uuid']
+    assert body['analyzed'] is True
+    assert 'job_id' not in body
+    assert mongo_db.jobs.count_documents({}) == 0
+
+    results = client.get(body['results'], params={'limit': 1000}).json()
+    assert [comparison['_id'] for comparison in results['comparisons']] == [comparison['_id'] for comparison in first['comparisons']]
+    assert client.get('/uploads/unknown/results').status_code == 404
+
+
+def test_upload_imputes_new_rows_with_whole_file_statistics(mongo_db, tmp_path):
+    client = TestClient(app)
+    stored = upload_frame(60, seed=7)
+    new = upload_frame(20, seed=8)
+    new.loc[new.index[:4], 'amount'] = None
+    superset = pd.concat([stored, new])
+    client.post('/upload_transactions/', files={'file': ('stored.csv', stored.to_csv(index=False))})
+    client.post('/upload_transactions/', files={'file': ('superset.csv', superset.to_csv(index=False))})
+
+    path = tmp_path / 'superset.csv'
+    superset.to_csv(path, index=False)
+    full, _, _ = preprocess_csv_file(str(path))
+    expected = dict(zip(full['transaction_id'], full['amount']))
+    imputed_ids = set(new['transaction_id'].iloc[:4]) & set(expected)
+    documents = list(mongo_db.transactions.find({'transaction_id': {'$in': new['transaction_id'].tolist()}}))
+    assert imputed_ids and imputed_ids <= {document['transaction_id'] for document in documents}
+    for document in documents:
+        assert document['amount'] == pytest.approx(expected[document['transaction_id']])